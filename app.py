@@ -1,6 +1,8 @@
 import streamlit as st
-from rag_engine import load_and_query, get_coverage_confidence
+from rag_engine import get_engine, query_stream
+from utils.tracing import METRICS, flatten
 import os
+import itertools
 from dotenv import load_dotenv
 from security_frameworks import get_all_frameworks, get_framework_questions, get_framework_info
 from datetime import datetime
@@ -142,6 +144,43 @@ def initialize_session_state():
         st.session_state.answers = []
     if 'selected_framework' not in st.session_state:
         st.session_state.selected_framework = None
+    if 'rag_session' not in st.session_state:
+        # Providers, caches and loaded documents are shared; the active document and history are not
+        st.session_state.rag_session = get_engine().new_session()
+
+def markdown_table(headers, rows) -> str:
+    """Markdown table, so the debug panel renders without pyarrow"""
+    def cell(value):
+        return str(value).replace('|', '\\|').replace('\n', ' ')
+    lines = ['| ' + ' | '.join(headers) + ' |', '|' + '---|' * len(headers)]
+    lines += ['| ' + ' | '.join(cell(value) for value in row) + ' |' for row in rows]
+    return '\n'.join(lines)
+
+def render_debug_panel(trace):
+    """Timed stages of the last answer, plus process-wide metrics"""
+    # The panel is diagnostics only; a failure here must not hide the answer above it
+    try:
+        with st.expander("🔬 Query trace", expanded=True):
+            first_token = next((span['attributes']['time_to_first_token_ms'] for span in flatten(trace)
+                                if 'time_to_first_token_ms' in span.get('attributes', {})), None)
+            st.caption(f"Total: {trace['duration_ms']:.1f} ms" + (f" · first token: {first_token:.1f} ms" if first_token is not None else ''))
+            st.markdown(markdown_table(['stage', 'ms', 'details'], [
+                (
+                    '&nbsp;' * 2 * span['depth'] + span['name'] + (f" ({span['labels']['provider']})" if 'provider' in span.get('labels', {}) else ''),
+                    f"{span['duration_ms']:.1f}",
+                    ', '.join(f"{key}={value}" for key, value in span.get('attributes', {}).items()) + (f" ❌ {span['error']}" if 'error' in span else '')
+                )
+                for span in flatten(trace)
+            ]))
+            counters = METRICS.snapshot()['counters']
+            if counters:
+                st.markdown("**Counters (this process):**")
+                st.markdown(markdown_table(['metric', 'labels', 'value'], [
+                    (counter['name'], ', '.join(f"{k}={v}" for k, v in counter['labels'].items()), f"{counter['value']:g}")
+                    for counter in counters
+                ]))
+    except Exception as e:
+        st.warning(f"⚠️ Query trace unavailable: {e}")
 
 def main():
     # Initialize session state
@@ -217,6 +256,12 @@ def main():
                 st.session_state.example_question = question
                 st.session_state.use_sample_pdf = True
                 st.rerun()
+        
+        show_debug = st.toggle(
+            "🔬 Debug panel",
+            value=os.getenv('RAG_DEBUG_PANEL', '').lower() in ('1', 'true', 'yes'),
+            help="Show where the time went for each answer"
+        )
     
     # Primary workflow section (upload, ask, get answer)
     col1, col2 = st.columns([1, 1])
@@ -246,48 +291,54 @@ def main():
             del st.session_state.example_question
         active_pdf, is_sample = get_active_pdf(uploaded_file)
         if question and active_pdf:
-            with st.spinner("🔍 Searching your policy..."):
-                try:
-                    answer, source = load_and_query(active_pdf, question)
-                    confidence, reasoning = get_coverage_confidence(question)
-                    answer_data = {
-                        'question': question,
-                        'answer': answer,
-                        'source': source,
-                        'confidence': confidence,
-                        'reasoning': reasoning,
-                        'framework': st.session_state.selected_framework,
-                        'timestamp': datetime.now().isoformat()
-                    }
-                    st.session_state.answers.append(answer_data)
-                    if answer and answer.strip():
-                        st.markdown('<div class="answer-box">', unsafe_allow_html=True)
-                        st.markdown("**Answer:**")
-                        st.write(answer)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    if source and source.strip() and ("http" in source or (source.lower().startswith("page") is False and source.lower() != "no source found")):
-                        st.markdown('<div class="source-box">', unsafe_allow_html=True)
-                        st.markdown("**📖 Source:**")
-                        st.write(source)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    if confidence and confidence > 0:
-                        st.markdown('<div class="confidence-box">', unsafe_allow_html=True)
-                        st.markdown(f'<div class="confidence-score">🎯 Confidence: {confidence}%</div>', unsafe_allow_html=True)
-                        st.markdown("**Evaluation:**")
-                        st.write(reasoning)
-                        st.markdown("""
-                        <small>
-                        <strong>What this means:</strong><br>
-                        • <strong>90%+:</strong> Excellent match with detailed, relevant information<br>
-                        • <strong>70-89%:</strong> Good match with sufficient context<br>
-                        • <strong>50-69%:</strong> Moderate match - answer may be limited<br>
-                        • <strong>Below 50%:</strong> Weak match - consider rephrasing question
-                        </small>
-                        """, unsafe_allow_html=True)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                except Exception as e:
-                    st.error(f"❌ Error processing question: {str(e)}")
-                    st.info("💡 Try re-uploading the PDF or check if the file is corrupted.")
+            try:
+                # The spinner covers retrieval and the wait for the first token; the answer then streams in
+                with st.spinner("🔍 Searching your policy..."):
+                    stream = query_stream(active_pdf, question, session=st.session_state.rag_session)
+                    deltas = iter(stream)
+                    first = next(deltas, '')
+                st.markdown('<div class="answer-box">', unsafe_allow_html=True)
+                st.markdown("**Answer:**")
+                st.write_stream(itertools.chain([first], deltas))
+                st.markdown('</div>', unsafe_allow_html=True)
+                result = stream.result
+                answer, source = result.answer, result.source
+                confidence, reasoning = result.confidence, result.reasoning
+                answer_data = {
+                    'question': question,
+                    'answer': answer,
+                    'source': source,
+                    'confidence': confidence,
+                    'reasoning': reasoning,
+                    'framework': st.session_state.selected_framework,
+                    'timestamp': datetime.now().isoformat()
+                }
+                st.session_state.answers.append(answer_data)
+                if source and source.strip() and ("http" in source or (source.lower().startswith("page") is False and source.lower() != "no source found")):
+                    st.markdown('<div class="source-box">', unsafe_allow_html=True)
+                    st.markdown("**📖 Source:**")
+                    st.write(source)
+                    st.markdown('</div>', unsafe_allow_html=True)
+                if confidence and confidence > 0:
+                    st.markdown('<div class="confidence-box">', unsafe_allow_html=True)
+                    st.markdown(f'<div class="confidence-score">🎯 Confidence: {confidence}%</div>', unsafe_allow_html=True)
+                    st.markdown("**Evaluation:**")
+                    st.write(reasoning)
+                    st.markdown("""
+                    <small>
+                    <strong>What this means:</strong><br>
+                    • <strong>90%+:</strong> Excellent match with detailed, relevant information<br>
+                    • <strong>70-89%:</strong> Good match with sufficient context<br>
+                    • <strong>50-69%:</strong> Moderate match - answer may be limited<br>
+                    • <strong>Below 50%:</strong> Weak match - consider rephrasing question
+                    </small>
+                    """, unsafe_allow_html=True)
+                    st.markdown('</div>', unsafe_allow_html=True)
+                if show_debug and result.trace:
+                    render_debug_panel(result.trace)
+            except Exception as e:
+                st.error(f"❌ Error processing question: {str(e)}")
+                st.info("💡 Try re-uploading the PDF or check if the file is corrupted.")
         elif question and not active_pdf:
             st.warning("⚠️ No PDF available. Please upload a PDF or ensure the sample PDF is present.")
 
@@ -0,0 +1,186 @@
+"""
+Bulk Questionnaire Runner
+Answers a whole framework or a CSV/XLSX vendor questionnaire against one
+policy document (or several searched together), running questions
+concurrently with per-provider limits.
+
+    python batch_runner.py policy.pdf --framework SOC2 --output soc2_answers.csv
+    python batch_runner.py policy.pdf --questions questionnaire.xlsx --workers 16 --limit groq=2
+    python batch_runner.py soc2_report.pdf iso_soa.pdf privacy.pdf --framework GDPR
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from rag_engine import RAGEngine
+from security_frameworks import get_framework_questions
+from utils import profiling
+
+RESULT_FIELDS = ['question', 'answer', 'source', 'confidence', 'reasoning', 'retrieval_stage']
+
+
+def _question_column(header: List[str]) -> int:
+    """Index of the column holding questions (named 'question', else the first)"""
+    for i, name in enumerate(header):
+        if name and str(name).strip().lower() in ('question', 'questions'):
+            return i
+    return 0
+
+
+def _questions_from_rows(rows: List[List]) -> List[str]:
+    if not rows:
+        return []
+    header = [str(cell or '') for cell in rows[0]]
+    has_header = any(name.strip().lower() in ('question', 'questions') for name in header)
+    column = _question_column(header) if has_header else 0
+    body = rows[1:] if has_header else rows
+    return [str(row[column]).strip() for row in body if len(row) > column and row[column] and str(row[column]).strip()]
+
+
+def load_questions(source: str) -> List[str]:
+    """
+    Load questions from a framework key (e.g. 'SOC2') or a .csv/.xlsx file
+    """
+    if os.path.exists(source):
+        extension = os.path.splitext(source)[1].lower()
+        if extension == '.csv':
+            with open(source, newline='', encoding='utf-8-sig') as f:
+                return _questions_from_rows(list(csv.reader(f)))
+        if extension in ('.xlsx', '.xlsm'):
+            import openpyxl  # only needed for Excel questionnaires
+            workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+            rows = [list(row) for row in workbook.active.iter_rows(values_only=True)]
+            workbook.close()
+            return _questions_from_rows(rows)
+        raise ValueError(f"Unsupported questionnaire format: {extension}")
+
+    questions = get_framework_questions(source)
+    if not questions:
+        raise ValueError(f"'{source}' is neither a questionnaire file nor a known framework")
+    return questions
+
+
+def answer_questionnaire(pdf_file, questions: List[str], engine: Optional[RAGEngine] = None,
+                         max_workers: int = 8, provider_limits: Optional[Dict[str, int]] = None,
+                         on_result: Optional[Callable[[Dict[str, any]], None]] = None) -> List[Dict[str, any]]:
+    """
+    Answer every question against one document, or a list of documents
+    searched together, on a bounded thread pool
+    Returns: one result dict per question, in input order
+    """
+    engine = engine or RAGEngine()
+    if provider_limits:
+        engine.set_provider_limits(provider_limits)
+
+    # Chunk and index the document(s) once, before fanning out
+    if isinstance(pdf_file, (list, tuple)):
+        for document in pdf_file:
+            engine.add_document(document)
+        engine.use_corpus()
+    else:
+        engine.load_document(pdf_file)
+
+    def run(question: str) -> Dict[str, any]:
+        # A session per question: answer history feeds confidence scoring, so a
+        # shared one would make each result depend on which questions ran first
+        session = engine.new_session()
+        session.chunks = engine.chunks
+        session.embeddings = engine.embeddings
+        session.keyword_index = engine.keyword_index
+        session.document_id = engine.document_id
+        try:
+            result = session.query(None, question)
+            row = {
+                'question': question,
+                'answer': result.answer,
+                'source': result.source,
+                'confidence': result.confidence,
+                'reasoning': result.reasoning,
+                'retrieval_stage': result.retrieval_stage
+            }
+        except Exception as e:
+            row = {'question': question, 'answer': f"Error: {e}", 'source': '', 'confidence': 0.0, 'reasoning': '', 'retrieval_stage': ''}
+        if on_result:
+            on_result(row)
+        return row
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(run, questions))
+
+
+def write_results(results: List[Dict[str, any]], output_path: str):
+    """Write results as .json, .xlsx or (default) .csv"""
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension == '.json':
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    elif extension == '.xlsx':
+        import openpyxl
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(RESULT_FIELDS)
+        for row in results:
+            sheet.append([row[field] for field in RESULT_FIELDS])
+        workbook.save(output_path)
+    else:
+        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def _parse_limits(values: List[str]) -> Dict[str, int]:
+    limits = {}
+    for value in values or []:
+        provider, _, limit = value.partition('=')
+        limits[provider.strip().lower()] = int(limit)
+    return limits
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Answer a security questionnaire in bulk")
+    parser.add_argument('pdf', nargs='+', help="Policy document(s) to answer from")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--framework', help="Framework key, e.g. SOC2, ISO27001, GDPR, HIPAA")
+    source.add_argument('--questions', help="CSV or XLSX questionnaire (uses the 'question' column)")
+    parser.add_argument('--output', default='questionnaire_results.csv', help="Results file (.csv, .json or .xlsx)")
+    parser.add_argument('--workers', type=int, default=8, help="Questions answered concurrently")
+    parser.add_argument('--limit', action='append', metavar='PROVIDER=N',
+                        help="Max concurrent requests for a provider, e.g. groq=2 (repeatable)")
+    parser.add_argument('--profile', metavar='MODES',
+                        help="Profile ingest and scoring hot paths: cprofile, sampling and/or tracemalloc (comma-separated)")
+    parser.add_argument('--profile-dir', help="Where profile dumps are written (default .rag_profiles)")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    if args.profile:
+        profiling.configure(args.profile, directory=args.profile_dir)
+    questions = load_questions(args.framework or args.questions)
+    done = []
+
+    def progress(row: Dict[str, any]):
+        done.append(row)
+        print(f"[{len(done)}/{len(questions)}] {row['confidence']}% {row['question']}", file=sys.stderr)
+
+    start = time.time()
+    results = answer_questionnaire(
+        args.pdf if len(args.pdf) > 1 else args.pdf[0], questions,
+        max_workers=args.workers,
+        provider_limits=_parse_limits(args.limit),
+        on_result=progress
+    )
+    write_results(results, args.output)
+    print(f"✅ Answered {len(results)} questions in {time.time() - start:.1f}s -> {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""
+Ingest and Retrieval Benchmark
+Generates synthetic security-policy PDFs (framework terminology from
+SECURITY_FRAMEWORKS) and measures how ingest, chunking, keyword search and
+confidence scoring scale with document size. Results are written as JSON
+and can be compared against an earlier run to catch regressions.
+
+    python benchmark.py --pages 10 100 500 2000 --output bench.json
+    python benchmark.py --baseline bench.json --output bench_new.json --tolerance 0.25
+
+No API keys are used: retrieval runs on the local indexes only.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from security_frameworks import SECURITY_FRAMEWORKS
+
+GENERATOR_VERSION = 1  # bump when synthetic page content changes
+
+# Metric -> (whether higher is better, noise floor), for --baseline comparisons.
+# Changes smaller than the noise floor (in the metric's own unit) are timer or
+# allocator noise, whatever the ratio; throughput has no floor, its duration does
+METRICS = {
+    ('ingest', 'pages_per_s'): (True, None),
+    ('ingest', 'peak_mb'): (False, 0.5),
+    ('split', 'pages_per_s'): (True, None),
+    ('keyword_search', 'p50_ms'): (False, 0.2),
+    ('keyword_search', 'p99_ms'): (False, 0.5),
+    ('confidence', 'p50_ms'): (False, 0.2),
+    ('confidence', 'p99_ms'): (False, 0.5),
+}
+
+# Throughput changes whose duration differs by less than this are noise
+NOISE_FLOOR_SECONDS = 0.002
+
+# Each timed throughput run repeats its call until at least this long has passed,
+# so short calls (small documents) aren't dominated by timer and scheduler noise
+MIN_RUN_SECONDS = 0.2
+
+_CONTROLS = [
+    "All {term} data is encrypted at rest using AES-256 and in transit using TLS 1.2 or higher.",
+    "Access to {term} systems requires multi-factor authentication and is reviewed quarterly.",
+    "Backups supporting {term} are taken daily, retained for 35 days and restored in annual tests.",
+    "Security incidents affecting {term} are triaged within one hour by the on-call response team.",
+    "Changes to {term} follow the change management process with peer review and approval.",
+    "Vendors with access to {term} complete a risk assessment before onboarding and annually.",
+    "Logs for {term} are centralised, monitored for anomalies and kept for twelve months.",
+    "Personal data processed under {term} is minimised and deleted at the end of its retention period.",
+    "The disaster recovery plan for {term} targets a four hour recovery time objective.",
+    "Employees handling {term} complete security awareness training at hire and every year.",
+]
+
+# Input of the calibration workload; never change it, or old baselines stop being comparable
+_CALIBRATION_LINES = random.Random(0).choices(_CONTROLS, k=2000)
+
+
+def _framework_terms() -> List[str]:
+    terms = []
+    for framework in SECURITY_FRAMEWORKS.values():
+        terms.append(framework['name'])
+        terms.extend(framework['domains'])
+    return terms
+
+
+def _framework_questions() -> List[str]:
+    return [question for framework in SECURITY_FRAMEWORKS.values() for question in framework['common_questions']]
+
+
+def synthetic_pages(num_pages: int, seed: int = 0, lines_per_page: int = 40) -> List[List[str]]:
+    """Deterministic policy text, one list of lines per page"""
+    terms = _framework_terms()
+    frameworks = list(SECURITY_FRAMEWORKS.values())
+    pages = []
+    for page_num in range(num_pages):
+        rng = random.Random(seed * 1000003 + page_num)
+        framework = frameworks[page_num % len(frameworks)]
+        lines = [f"Section {page_num + 1}: {framework['name']} - {rng.choice(framework['domains'])}"]
+        while len(lines) < lines_per_page:
+            sentence = rng.choice(_CONTROLS).format(term=rng.choice(terms))
+            # Wrap to fit the page width
+            while sentence:
+                cut = sentence.rfind(' ', 0, 95) if len(sentence) > 95 else len(sentence)
+                lines.append(sentence[:cut])
+                sentence = sentence[cut:].strip()
+        pages.append(lines[:lines_per_page])
+    return pages
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """Render pages of text lines with reportlab"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(path, pagesize=letter)
+    pdf.setFont('Helvetica', 9)
+    for lines in pages:
+        y = 760
+        for line in lines:
+            pdf.drawString(40, y, line)
+            y -= 18
+        pdf.showPage()
+        pdf.setFont('Helvetica', 9)
+    pdf.save()
+
+
+def synthetic_pdf(pdf_dir: str, num_pages: int, seed: int = 0) -> str:
+    """Path of the synthetic PDF with num_pages pages, generated on first use"""
+    path = os.path.join(pdf_dir, f"policy_{num_pages}p_s{seed}_v{GENERATOR_VERSION}.pdf")
+    if not os.path.exists(path):
+        os.makedirs(pdf_dir, exist_ok=True)
+        write_pdf(path + '.tmp', synthetic_pages(num_pages, seed))
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def latency_stats(samples: List[float]) -> Dict[str, float]:
+    """p50/p99/mean in milliseconds for per-call durations in seconds"""
+    values = np.array(samples) * 1000
+    return {
+        'n': len(samples),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'mean_ms': round(float(values.mean()), 3)
+    }
+
+
+def _time_calls(fn: Callable[[str], any], questions: List[str], repeats: int) -> List[float]:
+    samples = []
+    for _ in range(repeats):
+        for question in questions:
+            start = time.perf_counter()
+            fn(question)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+class _gc_paused:
+    """Collect, then keep the garbage collector off while timing (as timeit does)"""
+
+    def __enter__(self):
+        gc.collect()
+        self.enabled = gc.isenabled()
+        gc.disable()
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            gc.enable()
+
+
+def _calibration_work() -> int:
+    """Fixed pure-Python text work, independent of the code under test"""
+    counts = {}
+    for line in _CALIBRATION_LINES:
+        for word in line.lower().split():
+            counts[word] = counts.get(word, 0) + 1
+    return len(sorted(counts, key=counts.get))
+
+
+def _calibrate() -> float:
+    """Mean seconds of the calibration work over MIN_RUN_SECONDS, i.e. how fast the machine currently is"""
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < MIN_RUN_SECONDS:
+        _calibration_work()
+        calls += 1
+    return (time.perf_counter() - start) / calls
+
+
+def _best_seconds(fn: Callable[[], any], runs: int) -> Tuple[float, any, float]:
+    """
+    Fastest per-call time of runs timed runs, after one untimed warmup call;
+    each run repeats the call for at least MIN_RUN_SECONDS
+    Returns: (seconds per call, return value of the last call, median calibration seconds)
+    """
+    value = fn()
+    best = float('inf')
+    calibrations = []
+    for _ in range(runs):
+        calibrations.append(_calibrate())
+        with _gc_paused():
+            calls = 0
+            start = time.perf_counter()
+            while True:
+                value = fn()
+                calls += 1
+                elapsed = time.perf_counter() - start
+                if elapsed >= MIN_RUN_SECONDS:
+                    break
+        best = min(best, elapsed / calls)
+    return best, value, float(np.median(calibrations))
+
+
+def _median_latency(fn: Callable[[str], any], questions: List[str], repeats: int, runs: int) -> Dict[str, float]:
+    """latency_stats of each of runs passes, after one untimed warmup pass; the median of each stat"""
+    for question in questions:
+        fn(question)
+    passes = []
+    calibrations = []
+    for _ in range(runs):
+        calibrations.append(_calibrate())
+        with _gc_paused():
+            passes.append(latency_stats(_time_calls(fn, questions, repeats)))
+    stats = {key: round(float(np.median([stats[key] for stats in passes])), 3) for key in passes[0]}
+    stats['n'] = passes[0]['n']
+    stats['runs'] = runs
+    stats['calibration_ms'] = round(float(np.median(calibrations)) * 1000, 3)
+    return stats
+
+
+def bench_document(pdf_path: str, num_pages: int, repeats: int = 5, measure_memory: bool = True,
+                   runs: int = 5) -> Dict[str, any]:
+    """
+    Benchmark ingest, chunking, keyword search and confidence on one PDF
+    Each timing follows a warmup call and runs with the garbage collector
+    paused; throughput is the best of runs, latencies the median of runs passes.
+    Every section records calibration_ms, timed between its runs, for compare()
+    """
+    from utils.pdf_loader import PDFLoader
+    from rag_engine import RAGEngine
+
+    with open(pdf_path, 'rb') as f:
+        pdf_bytes = f.read()
+
+    loader = PDFLoader()
+    ingest_seconds, chunks, ingest_calibration = _best_seconds(lambda: loader.load_pdf(pdf_bytes), runs)
+    result = {
+        'pages': num_pages,
+        'pdf_bytes': len(pdf_bytes),
+        'ingest': {
+            'seconds': round(ingest_seconds, 4),
+            'pages_per_s': round(num_pages / ingest_seconds, 1),
+            'chunks': len(chunks),
+            'calibration_ms': round(ingest_calibration * 1000, 3)
+        }
+    }
+
+    if measure_memory:
+        # Separate pass: tracemalloc slows allocation-heavy code down. Serial, because
+        # tracemalloc can't see pages extracted in pool workers
+        gc.collect()
+        tracemalloc.start()
+        PDFLoader(workers=1).load_pdf(pdf_bytes)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['ingest']['peak_mb'] = round(peak / 2 ** 20, 2)
+
+    # Chunking alone, on the generated page text
+    texts = ['\n'.join(lines) for lines in synthetic_pages(num_pages)]
+    split = lambda: sum(len(loader._split_text_into_chunks(text, page_num)) for page_num, text in enumerate(texts, 1))
+    split_seconds, split_chunks, split_calibration = _best_seconds(split, runs)
+    result['split'] = {
+        'seconds': round(split_seconds, 4),
+        'pages_per_s': round(num_pages / split_seconds, 1),
+        'chunks': split_chunks,
+        'calibration_ms': round(split_calibration * 1000, 3)
+    }
+
+    # Retrieval over the loaded document, local indexes only
+    engine = RAGEngine()
+    engine.models = {}
+    engine.breakers = {}
+    engine.chunks = chunks
+    engine.embeddings = loader.vector_index
+    engine.keyword_index = loader.keyword_index
+    engine.document_id = f"benchmark-{num_pages}"
+
+    questions = _framework_questions()
+    result['keyword_search'] = _median_latency(engine._keyword_search, questions, repeats, runs)
+    result['confidence'] = _median_latency(engine.get_coverage_confidence, questions, repeats, runs)
+    return result
+
+
+def compare(results: Dict[str, any], baseline: Dict[str, any], tolerance: float) -> List[Dict[str, any]]:
+    """
+    Metric changes against a baseline run, per document size
+    Returns: one row per metric present in both; 'regression' marks changes
+    worse than tolerance (a fraction, e.g. 0.25 for 25%) and above the metric's noise floor
+
+    Timings are compared after scaling the baseline by how much faster or
+    slower the section's calibration work ran, so a slow phase of a shared machine
+    doesn't read as a regression; 'machine_speed' is that ratio and
+    'baseline' the scaled value.
+    """
+    previous = {run['pages']: run for run in baseline.get('runs', [])}
+    rows = []
+    for run in results['runs']:
+        old = previous.get(run['pages'])
+        if old is None:
+            continue
+        for (section, metric), (higher_is_better, noise_floor) in METRICS.items():
+            new_value = run.get(section, {}).get(metric)
+            old_value = old.get(section, {}).get(metric)
+            if not new_value or not old_value:
+                continue
+            new_calibration = run[section].get('calibration_ms')
+            old_calibration = old[section].get('calibration_ms')
+            speed = old_calibration / new_calibration if new_calibration and old_calibration else 1.0
+            if metric == 'pages_per_s':
+                old_value = old_value * speed
+            elif metric.endswith('_ms'):
+                old_value = old_value / speed
+            change = new_value / old_value - 1
+            worse = -change if higher_is_better else change
+            if noise_floor is None:
+                # pages/s: compare the durations behind it
+                noise = abs(run['pages'] / new_value - run['pages'] / old_value) < NOISE_FLOOR_SECONDS
+            else:
+                noise = abs(new_value - old_value) < noise_floor
+            if noise:
+                worse = 0.0
+            rows.append({
+                'pages': run['pages'],
+                'metric': f"{section}.{metric}",
+                'baseline': round(old_value, 3),
+                'current': new_value,
+                'machine_speed': round(speed, 3),
+                'change': round(change, 3),
+                'regression': worse > tolerance
+            })
+    return rows
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ingest and retrieval on synthetic policy PDFs")
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 500, 2000], help="Document sizes to test")
+    parser.add_argument('--repeats', type=int, default=5, help="Passes over the framework questions per latency sample")
+    parser.add_argument('--runs', type=int, default=5, help="Timed runs per metric, after a warmup; best throughput and median latency are kept")
+    parser.add_argument('--pdf-dir', default='.bench_pdfs', help="Where generated PDFs are kept between runs")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON results file")
+    parser.add_argument('--baseline', help="Earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative change before a regression is reported")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc pass")
+    parser.add_argument('--profile', metavar='MODES',
+                        help="Also dump cprofile, sampling and/or tracemalloc profiles of each hot path (skews timings)")
+    parser.add_argument('--profile-dir', help="Where profile dumps are written (default .rag_profiles)")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        from utils import profiling
+        profiling.configure(args.profile, directory=args.profile_dir, min_ms=1)
+
+    # Measure the work itself, not the document cache, and never call a provider
+    os.environ['RAG_CACHE_DIR'] = ''
+    for key in ('GEMINI_API_KEY', 'OPENAI_API_KEY', 'GROQ_API_KEY', 'COHERE_API_KEY'):
+        os.environ.pop(key, None)
+
+    from utils.pdf_loader import PDFLoader
+    from utils.tokenizer import get_tokenizer
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'tokenizer': get_tokenizer().name,
+            'extract_workers': PDFLoader().workers,  # ingest pass; the peak_mb pass uses 1
+            'generator_version': GENERATOR_VERSION,
+            'repeats': args.repeats,
+            'runs': args.runs
+        },
+        'runs': []
+    }
+
+    for num_pages in args.pages:
+        start = time.perf_counter()
+        pdf_path = synthetic_pdf(args.pdf_dir, num_pages)
+        print(f"[{num_pages} pages] PDF ready in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        run = bench_document(pdf_path, num_pages, repeats=args.repeats, measure_memory=not args.no_memory, runs=args.runs)
+        results['runs'].append(run)
+        print(
+            f"[{num_pages} pages] ingest {run['ingest']['pages_per_s']} pages/s"
+            + (f", peak {run['ingest']['peak_mb']} MB" if 'peak_mb' in run['ingest'] else '')
+            + f" | split {run['split']['pages_per_s']} pages/s"
+            f" | keyword p50 {run['keyword_search']['p50_ms']} ms p99 {run['keyword_search']['p99_ms']} ms"
+            f" | confidence p50 {run['confidence']['p50_ms']} ms p99 {run['confidence']['p99_ms']} ms",
+            file=sys.stderr
+        )
+
+    # Peak resident memory of the whole run and of the largest extraction worker (kilobytes on Linux)
+    results['meta']['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    results['meta']['max_rss_children_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            results['comparison'] = compare(results, json.load(f), args.tolerance)
+        regressions = [row for row in results['comparison'] if row['regression']]
+        for row in regressions:
+            print(f"❌ {row['pages']} pages {row['metric']}: {row['baseline']} -> {row['current']} ({row['change']:+.0%})", file=sys.stderr)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {args.output}" + (f", {len(regressions)} regressions" if args.baseline else ''), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
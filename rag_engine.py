@@ -1,15 +1,161 @@
 import os
-import google.generativeai as genai
-from typing import Tuple, List, Dict
-from utils.pdf_loader import PDFLoader
-import streamlit as st
-import openai
-import cohere
-import groq
+import asyncio
+import contextvars
+import copy
+from typing import Tuple, List, Dict, Optional, Iterator, Callable, Union
+from dataclasses import dataclass, field
+from utils.pdf_loader import PDFLoader, read_pdf_bytes
+from utils.chunk_store import ChunkStore
+from utils.document_cache import DocumentCache, document_hash, file_hash
+from utils.response_cache import ResponseCache
+from utils.hedging import hedged_call
+from utils.circuit_breaker import CircuitBreaker
+from utils.context_packer import pack_chunks, format_context
+from utils.corpus import Corpus
+from utils.lazy_import import LazyModule
+from utils.providers import PROVIDERS
+from utils.tracing import TRACER, traced
+from utils.profiling import profiled
+from utils.tokenizer import get_tokenizer
+from concurrent.futures import ThreadPoolExecutor
 import re
+import threading
+import time
+import weakref
 from datetime import datetime
 
+# Streamlit and the provider SDKs are imported on first use (see utils/providers.py)
+st = LazyModule('streamlit')
+
+# Context window of each provider's model, in tokens
+MODEL_CONTEXT_WINDOWS = {
+    'gemini': 1048576,
+    'openai': 16385,
+    'groq': 8192,
+    'cohere': 4096,
+    'fake': 16385
+}
+
+# Completion tokens requested for an answer
+ANSWER_MAX_TOKENS = 200
+
+# Tokens held back from the context budget for the prompt's instructions and question
+PROMPT_OVERHEAD_TOKENS = 256
+
+# Maximum in-flight requests per provider when questions are answered concurrently
+DEFAULT_PROVIDER_CONCURRENCY = {
+    'gemini': 4,
+    'openai': 4,
+    'groq': 2,
+    'cohere': 2
+}
+
+# Retrieval cascade stages, cheapest first
+RETRIEVAL_STAGES = (
+    'local',           # local ranking was decisive
+    'llm_rerank',      # LLM picked among the top local candidates
+    'local_fallback',  # ranking was close but reranking failed, local top-1 used
+    'keyword',         # no vector overlap, BM25 keyword ranking used
+    'llm',             # no local index, LLM picked from the leading chunks
+    'none'             # nothing relevant found
+)
+
+@dataclass
+class QueryResult:
+    """Everything produced for one question from a single retrieval"""
+    question: str
+    answer: str
+    source: str
+    chunk: Optional[Dict[str, any]] = None
+    confidence: float = 0.0
+    reasoning: str = ""
+    confidence_factors: Dict[str, float] = field(default_factory=dict)
+    retrieval_stage: str = ""  # which cascade stage picked the chunk (see RETRIEVAL_STAGES)
+    trace: Optional[Dict[str, any]] = None  # timed stages of this question (utils.tracing)
+
+class AnswerStream:
+    """
+    Answer text deltas for one question, in the order the model produced
+    them. Iterate it once, with for or async for; when it is exhausted
+    .result holds the QueryResult (full answer, source, confidence, trace).
+    """
+    
+    def __init__(self, deltas, engine: 'RAGEngine'):
+        self._deltas = deltas
+        self._engine = engine
+        self._context = contextvars.copy_context()  # keeps every step inside the question's trace
+        self.result: Optional[QueryResult] = None
+    
+    def _step(self):
+        try:
+            return True, self._context.run(next, self._deltas)
+        except StopIteration as done:
+            self.result = done.value
+            return False, None
+    
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            more, delta = self._step()
+            if not more:
+                return
+            yield delta
+    
+    async def __aiter__(self):
+        # The stream is produced on its own thread into a queue, so it never
+        # holds a pool thread, and its provider slot is released as soon as
+        # the provider is done, however slowly the consumer reads
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:  # event loop closed, nobody is listening
+                stop.set()
+        
+        def produce():
+            try:
+                while not stop.is_set():
+                    more, delta = self._step()
+                    put((more, delta, None))
+                    if not more:
+                        return
+            except Exception as e:
+                put((False, None, e))
+            finally:
+                if stop.is_set():
+                    self.close()
+        
+        async with self._engine._async_gate():
+            threading.Thread(target=produce, name='rag-answer-stream', daemon=True).start()
+            try:
+                while True:
+                    more, delta, error = await queue.get()
+                    if error is not None:
+                        raise error
+                    if not more:
+                        return
+                    yield delta
+            finally:
+                stop.set()
+    
+    def close(self):
+        """Abandon the stream, releasing its provider connection"""
+        self._context.run(self._deltas.close)
+
 class RAGEngine:
+    """
+    Question answering over security policy documents.
+    
+    One engine per process owns everything that is expensive or must be
+    shared: provider clients, circuit breakers, concurrency limits, thread
+    pools and the document and response caches. Cached chunk stores and
+    indexes are never modified once built, so every session reads the same
+    copy. new_session() hands out lightweight engines that share all of
+    that but keep their own active document, corpus and answer history.
+    """
+    
     def __init__(self):
         # Load API keys from environment
         self.gemini_api_key = os.getenv('GEMINI_API_KEY')
@@ -17,53 +163,124 @@ class RAGEngine:
         self.cohere_api_key = os.getenv('COHERE_API_KEY')
         self.groq_api_key = os.getenv('GROQ_API_KEY')
         
+        # Per-provider request timeouts in seconds (RAG_GEMINI_TIMEOUT, ...)
+        default_timeout = float(os.getenv('RAG_PROVIDER_TIMEOUT', 30))
+        self.provider_timeouts = {
+            name: float(os.getenv(f'RAG_{name.upper()}_TIMEOUT', default_timeout))
+            for name in PROVIDERS
+        }
+        self.default_timeout = default_timeout
+        
+        # Hedged requests: if the current provider hasn't answered within this
+        # budget (e.g. its p95 latency), race the next one. 0 disables hedging.
+        self.hedge_delay = float(os.getenv('RAG_HEDGE_MS', 0)) / 1000
+        # Abandoned slow calls keep their thread until the provider times out, so leave headroom
+        self._hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='llm-hedge')
+        
+        # Async API: blocking SDK calls run on a bounded pool, and at most
+        # max_inflight questions per event loop are admitted (the rest wait)
+        self._async_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('RAG_ASYNC_WORKERS', 32)), thread_name_prefix='rag-async'
+        )
+        self.max_inflight = int(os.getenv('RAG_ASYNC_MAX_INFLIGHT', 256))
+        self._async_gates = weakref.WeakKeyDictionary()  # event loop -> asyncio.Semaphore
+        
         # Initialize models with fallback logic
         self.models = self._initialize_models()
         
-        self.pdf_loader = PDFLoader()
+        # Circuit breaker per provider so a failing one is skipped instead of retried every question
+        self.breakers = {
+            model_name: CircuitBreaker(model_name, cooldown=float(os.getenv('RAG_BREAKER_COOLDOWN', 30)))
+            for model_name in self.models
+        }
+        
+        self.pdf_loader = PDFLoader()  # settings template; each load works on a copy
+        
+        # Concurrent loads of the same PDF (e.g. two sessions) extract it only once
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._load_locks_guard = threading.Lock()
+        
+        # Chunked documents keyed by content hash and chunking settings, in memory, and
+        # on disk only if RAG_CACHE_DIR opts in (the disk cache holds document text)
+        cache_dir = os.getenv('RAG_CACHE_DIR', '')
+        self.document_cache = DocumentCache(cache_dir=cache_dir, settings=self.pdf_loader.chunking_settings)
+        
+        # LLM responses keyed by provider, model, document and prompt
+        self.response_cache = ResponseCache(
+            path=os.path.join(cache_dir, 'responses.sqlite') if cache_dir else ':memory:',
+            ttl_seconds=float(os.getenv('RAG_RESPONSE_TTL', 7 * 24 * 3600)),
+            max_bytes=int(os.getenv('RAG_RESPONSE_CACHE_BYTES', 64 * 1024 * 1024))
+        )
+        
+        # Retrieval cascade: only ask an LLM to rerank the top candidates when
+        # the local ranking is close, i.e. (top1 - top2) / top1 < rerank_margin
+        self.rerank_margin = float(os.getenv('RAG_RERANK_MARGIN', 0.1))
+        self.rerank_top_k = int(os.getenv('RAG_RERANK_TOP_K', 5))
+        self.retrieval_stats = {stage: 0 for stage in RETRIEVAL_STAGES}  # across all sessions
+        self._stats_lock = threading.Lock()
+        
+        # Prompt context budgets in tokens (capped by each model's context window)
+        self.context_tokens = int(os.getenv('RAG_CONTEXT_TOKENS', 2000))
+        self.search_context_tokens = int(os.getenv('RAG_SEARCH_CONTEXT_TOKENS', 1000))
+        self.context_candidates = int(os.getenv('RAG_CONTEXT_CHUNKS', 12))
+        
+        # Bound concurrent calls to each provider (batch runs, many sessions);
+        # a call that can't get a slot within provider_wait seconds fails
+        self.provider_limits = {}
+        self.set_provider_limits(DEFAULT_PROVIDER_CONCURRENCY)
+        self.provider_wait = float(os.getenv('RAG_PROVIDER_WAIT', 60))
+        
+        self._reset_session_state()
+    
+    def _reset_session_state(self):
+        """Per-session state: the active document, corpus selection and answer history"""
         self.chunks = []
-        self.embeddings = []
+        self.embeddings = None     # VectorIndex over self.chunks
+        self.keyword_index = None  # KeywordIndex over self.chunks
+        self.document_id = None    # SHA-256 of the PDF the chunks came from
+        self.last_revision = None  # report from the most recent incremental re-ingest
+        
+        # Documents searchable together (use_corpus makes a selection of them active)
+        self.corpus = Corpus()
         
         # Track answer history for confidence improvement
         self.answer_history = []
+        self._history_lock = threading.Lock()
+    
+    def new_session(self) -> 'RAGEngine':
+        """
+        Engine for one user session: shares this engine's provider clients,
+        caches, breakers, limits and loaded indexes (nothing is copied), with
+        its own active document, corpus and answer history
+        """
+        session = copy.copy(self)
+        session._reset_session_state()
+        return session
+    
+    def set_provider_limits(self, limits: Dict[str, int]):
+        """Set the maximum number of concurrent requests for each provider"""
+        for model_name, limit in limits.items():
+            self.provider_limits[model_name] = threading.BoundedSemaphore(max(1, int(limit)))
     
     def _initialize_models(self) -> Dict[str, any]:
-        """Initialize available models with fallback priority"""
+        """Initialize available models with fallback priority (PROVIDERS order)"""
         models = {}
         
-        # Try Gemini first
-        if self.gemini_api_key:
-            try:
-                genai.configure(api_key=self.gemini_api_key)
-                models['gemini'] = genai.GenerativeModel('gemini-2.0-flash')
-                st.success("✅ Using Google Gemini for enhanced search")
-            except Exception as e:
-                st.warning(f"⚠️ Gemini initialization failed: {e}")
-        
-        # Try OpenAI as fallback
-        if self.openai_api_key and 'gemini' not in models:
-            try:
-                openai.api_key = self.openai_api_key
-                models['openai'] = 'gpt-3.5-turbo'
-                st.success("✅ Using OpenAI GPT-3.5 for enhanced search")
-            except Exception as e:
-                st.warning(f"⚠️ OpenAI initialization failed: {e}")
-        
-        # Try Groq as fallback
-        if self.groq_api_key and 'gemini' not in models and 'openai' not in models:
-            try:
-                models['groq'] = groq.Groq(api_key=self.groq_api_key)
-                st.success("✅ Using Groq for enhanced search")
-            except Exception as e:
-                st.warning(f"⚠️ Groq initialization failed: {e}")
-        
-        # Try Cohere as fallback
-        if self.cohere_api_key and len(models) == 0:
+        for model_name, backend in PROVIDERS.items():
+            if backend.api_key_env is None:
+                api_key = ''
+            else:
+                api_key = getattr(self, f'{model_name}_api_key', None) or os.getenv(backend.api_key_env)
+                if not api_key:
+                    continue
+            # Only now is the provider's SDK imported
             try:
-                models['cohere'] = cohere.Client(self.cohere_api_key)
-                st.success("✅ Using Cohere for enhanced search")
+                models[model_name] = backend.create(
+                    api_key, backend.model_id, self.provider_timeouts.get(model_name, self.default_timeout)
+                )
+                st.success(f"✅ Using {backend.label} for enhanced search" if len(models) == 1 else f"✅ {backend.label} available as fallback")
             except Exception as e:
-                st.warning(f"⚠️ Cohere initialization failed: {e}")
+                st.warning(f"⚠️ {backend.label} initialization failed: {e}")
         
         if not models:
             st.info("ℹ️ No API keys available. Using keyword search only.")
@@ -75,189 +292,687 @@ class RAGEngine:
         Main function: Load PDF and answer question
         Returns: (answer, source_citation)
         """
-        # Load and chunk PDF
-        if not self.chunks:
-            self.chunks = self.pdf_loader.load_pdf(pdf_file)
+        result = self.query(pdf_file, question)
+        return result.answer, result.source
+    
+    def query(self, pdf_file, question: str) -> QueryResult:
+        """
+        Load PDF and answer question with a single retrieval
+        Returns: QueryResult with answer, source, chunk, confidence and trace
+        """
+        with TRACER.span('query') as span:
+            result = self._query(pdf_file, question)
+            span.set(retrieval_stage=result.retrieval_stage, document_id=self.document_id)
+        TRACER.count('rag_queries_total', stage=result.retrieval_stage)
+        result.trace = span.to_dict()
+        return result
+    
+    def _query(self, pdf_file, question: str) -> QueryResult:
+        # Load and chunk PDF (or reuse the cached copy)
+        self.load_document(pdf_file)
         
         # Find most relevant chunk
-        best_chunk = self._find_best_chunk(question)
+        best_chunk, stage = self._retrieve(question)
         
         if not best_chunk:
-            return "I couldn't find relevant information in the document.", "No source found"
+            return self._not_found_result(question, stage)
         
-        # Generate answer using available LLM
-        answer = self._generate_answer(question, best_chunk['text'])
+        # Generate answer using available LLM, packing further top-ranked chunks around the best one
+        answer = self._generate_answer(question, best_chunk['text'], self._context_candidates(question, best_chunk))
+        return self._build_result(question, answer, best_chunk, stage)
+    
+    @staticmethod
+    def _not_found_result(question: str, stage: str) -> QueryResult:
+        return QueryResult(
+            question=question,
+            answer="I couldn't find relevant information in the document.",
+            source="No source found",
+            reasoning="No relevant information found in document",
+            retrieval_stage=stage
+        )
+    
+    def _build_result(self, question: str, answer: str, best_chunk: Dict[str, any], stage: str) -> QueryResult:
+        """Cite, record and score an answer generated from best_chunk"""
         source = self.pdf_loader.get_chunk_source(best_chunk)
         
         # Store answer in history for confidence improvement
         self._store_answer_history(question, answer, source, best_chunk)
         
-        return answer, source
+        # Score confidence against the same chunk the answer came from
+        confidence_factors = self._calculate_confidence_factors(question, best_chunk)
+        
+        return QueryResult(
+            question=question,
+            answer=answer,
+            source=source,
+            chunk=best_chunk,
+            confidence=self._combine_confidence_factors(confidence_factors),
+            reasoning=self._generate_confidence_reasoning(confidence_factors),
+            confidence_factors=confidence_factors,
+            retrieval_stage=stage
+        )
+    
+    def query_stream(self, pdf_file, question: str) -> 'AnswerStream':
+        """
+        Like query, but the answer arrives as text deltas while the model
+        generates it: iterate (or async-iterate) the returned AnswerStream,
+        then read its .result for the source, confidence and trace
+        """
+        return AnswerStream(self._stream_query(pdf_file, question), self)
+    
+    def _stream_query(self, pdf_file, question: str) -> Iterator[str]:
+        with TRACER.span('query') as span:
+            self.load_document(pdf_file)
+            best_chunk, stage = self._retrieve(question)
+            
+            if not best_chunk:
+                result = self._not_found_result(question, stage)
+                yield result.answer
+            else:
+                parts = []
+                with TRACER.span('generate_answer'):
+                    for delta in self._generate_answer_stream(
+                        question, best_chunk['text'], self._context_candidates(question, best_chunk)
+                    ):
+                        parts.append(delta)
+                        yield delta
+                result = self._build_result(question, ''.join(parts), best_chunk, stage)
+            span.set(retrieval_stage=result.retrieval_stage, document_id=self.document_id, streamed=True)
+        TRACER.count('rag_queries_total', stage=result.retrieval_stage)
+        result.trace = span.to_dict()
+        return result
+    
+    def _generate_answer_stream(self, question: str, context: str,
+                                candidates: Optional[List[Dict[str, any]]] = None) -> Iterator[str]:
+        """
+        Stream an answer down the provider fallback chain. A provider that
+        fails before its first delta falls through to the next one; once
+        text has been shown the answer can't be retracted, so a later
+        failure ends it where it stopped.
+        """
+        fallback = f"Based on the document: {context[:300]}..."
+        if not self.models:
+            yield fallback
+            return
+        
+        build_prompt = self._answer_prompt(question, context, candidates)
+        for model_name, model in self._available_models():
+            streamed = False
+            try:
+                for delta in self._complete_stream(model_name, model, build_prompt(model_name), ANSWER_MAX_TOKENS):
+                    streamed = True
+                    yield delta
+                if streamed:
+                    return
+            except Exception as e:
+                st.warning(f"⚠️ {model_name} answer generation failed: {e}")
+                if streamed:
+                    return
+        
+        # If all models fail, return context
+        yield fallback
+    
+    async def load_and_query_async(self, pdf_file, question: str) -> Tuple[str, str]:
+        """
+        Async counterpart of load_and_query
+        Returns: (answer, source_citation)
+        """
+        result = await self.query_async(pdf_file, question)
+        return result.answer, result.source
+    
+    async def query_async(self, pdf_file, question: str) -> QueryResult:
+        """Async counterpart of query; waits for a free slot when max_inflight questions are running"""
+        return await self._run_async(self.query, pdf_file, question)
+    
+    async def get_coverage_confidence_async(self, question: str) -> Tuple[float, str]:
+        """Async counterpart of get_coverage_confidence"""
+        return await self._run_async(self.get_coverage_confidence, question)
+    
+    def _async_gate(self) -> asyncio.Semaphore:
+        """Admission semaphore for the running event loop"""
+        loop = asyncio.get_running_loop()
+        gate = self._async_gates.get(loop)
+        if gate is None:
+            gate = self._async_gates[loop] = asyncio.Semaphore(self.max_inflight)
+        return gate
+    
+    async def _run_async(self, func: Callable, *args):
+        """Run a blocking engine call on the async pool once the loop admits it"""
+        async with self._async_gate():
+            return await asyncio.get_running_loop().run_in_executor(self._async_executor, func, *args)
+    
+    @traced('load_document')
+    def load_document(self, pdf_file) -> str:
+        """
+        Make a PDF the active document, reusing cached chunks and indexes
+        Returns: SHA-256 content hash of the PDF
+        """
+        if pdf_file is None:
+            return self.document_id
+        
+        pdf_bytes = read_pdf_bytes(pdf_file)
+        doc_id = document_hash(pdf_bytes)
+        if doc_id == self.document_id and self.chunks:
+            return doc_id
+        
+        doc_id, entry = self._load_entry(pdf_bytes, self._document_name(pdf_file))
+        self.chunks = entry['chunks']
+        self.embeddings = entry['vector_index']
+        self.keyword_index = entry['keyword_index']
+        self.document_id = doc_id
+        return doc_id
+    
+    @staticmethod
+    def _document_name(pdf_file) -> Optional[str]:
+        """File name of an upload or path, if it has one"""
+        if isinstance(pdf_file, str):
+            return os.path.basename(pdf_file)
+        return getattr(pdf_file, 'name', None)
+    
+    def _load_entry(self, pdf_bytes: bytes, name: Optional[str]) -> Tuple[str, Dict[str, any]]:
+        """
+        Chunks and indexes of a PDF from the cache, an incremental re-ingest
+        of an earlier revision, or a full load
+        Returns: (content hash, cache entry)
+        """
+        doc_id = document_hash(pdf_bytes)
+        entry = self.document_cache.get(doc_id)
+        TRACER.count('rag_cache_requests_total', cache='document', result='miss' if entry is None else 'hit')
+        if entry is None:
+            with self._load_lock(doc_id):
+                # Another session may have loaded it while we waited
+                entry = self.document_cache.get(doc_id)
+                if entry is None:
+                    entry = self._ingest(doc_id, pdf_bytes, name)
+        
+        if name and entry['chunks']:
+            self.document_cache.record_revision(name, doc_id)
+        return doc_id, entry
+    
+    def _load_lock(self, doc_id: str) -> threading.Lock:
+        with self._load_locks_guard:
+            return self._load_locks.setdefault(doc_id, threading.Lock())
+    
+    def _ingest(self, doc_id: str, pdf_bytes: bytes, name: Optional[str]) -> Dict[str, any]:
+        """Extract and index a PDF that isn't cached yet, and cache it"""
+        loader = copy.copy(self.pdf_loader)
+        # A new revision of a known document (same name, or replacing the active one)
+        # only needs its changed pages extracted
+        base_id = (name and self.document_cache.latest_revision(name)) or self.document_id
+        base = self.document_cache.get(base_id) if base_id and base_id != doc_id else None
+        if base is not None and len(base.get('page_hashes', [])):
+            chunks = loader.reload_pdf(pdf_bytes, base)
+        else:
+            chunks = loader.load_pdf(pdf_bytes)
+        entry = {
+            'chunks': chunks,
+            'vector_index': loader.vector_index,
+            'keyword_index': loader.keyword_index,
+            'page_hashes': loader.page_hashes
+        }
+        if base is not None and len(loader.changed_pages) < len(entry['page_hashes']):
+            self.last_revision = self._revision_report(base_id, base, doc_id, entry, name, loader.changed_pages)
+            st.info(
+                f"ℹ️ Revised document: re-indexed {len(self.last_revision['changed_pages'])} of "
+                f"{len(entry['page_hashes'])} pages; {len(self.last_revision['invalidated_answers'])} "
+                f"earlier answers cite changed pages"
+            )
+        # Don't cache failed or empty extractions
+        if chunks:
+            self.document_cache.put(doc_id, entry)
+        return entry
+    
+    def add_document(self, pdf_file, name: Optional[str] = None, frameworks: Optional[List[str]] = None) -> Optional[str]:
+        """
+        Add a PDF to the corpus without changing the active document
+        frameworks tags it (e.g. ['SOC2']); detected from its text if not given
+        Returns: the document's content hash, or None if no text could be extracted
+        """
+        name = name or self._document_name(pdf_file)
+        doc_id, entry = self._load_entry(read_pdf_bytes(pdf_file), name)
+        if not entry['chunks']:
+            return None
+        self.corpus.add(doc_id, name, entry, frameworks)
+        return doc_id
+    
+    def remove_document(self, document: str) -> bool:
+        """Remove a document from the corpus by content hash or name"""
+        return self.corpus.remove(document)
+    
+    def use_corpus(self, documents: Optional[List[str]] = None, frameworks: Optional[List[str]] = None) -> str:
+        """
+        Make corpus documents the active document set, optionally only those
+        named in documents (ids or names) or tagged with one of frameworks
+        Returns: id of the selection (used like a document hash)
+        """
+        view_id, chunks, vector_index, keyword_index = self.corpus.view(documents, frameworks)
+        self.chunks = chunks
+        self.embeddings = vector_index
+        self.keyword_index = keyword_index
+        self.document_id = view_id
+        return view_id
+    
+    def query_corpus(self, question: str, documents: Optional[List[str]] = None,
+                     frameworks: Optional[List[str]] = None) -> QueryResult:
+        """Answer a question from several corpus documents at once; citations name the document"""
+        self.use_corpus(documents, frameworks)
+        return self.query(None, question)
+    
+    def _revision_report(self, base_id: str, base: Dict[str, any], doc_id: str,
+                         entry: Dict[str, any], name: Optional[str], changed_pages: List[int]) -> Dict[str, any]:
+        """
+        Summarize an incremental re-ingest: which pages changed, and which
+        earlier answers from the previous revision relied on pages that
+        changed or disappeared (their cached responses no longer apply)
+        """
+        new_hashes = set(entry['page_hashes'])
+        stale_pages = {page_num for page_num, page_hash in enumerate(base['page_hashes'], 1) if page_hash not in new_hashes}
+        with self._history_lock:
+            invalidated = [
+                {'question': hist['question'], 'source': hist['source']}
+                for hist in self.answer_history
+                if hist.get('document_id') == base_id and hist['chunk_page'] in stale_pages
+            ]
+        return {
+            'document': name,
+            'document_id': doc_id,
+            'previous_id': base_id,
+            'pages': len(entry['page_hashes']),
+            'changed_pages': list(changed_pages),
+            'stale_previous_pages': sorted(stale_pages),
+            'invalidated_answers': invalidated
+        }
+    
+    def stream_document(self, pdf_file, max_buffer_bytes: int = 4 * 1024 * 1024) -> Iterator[int]:
+        """
+        Make a PDF the active document by ingesting it page by page
+        Yields: number of chunks searchable so far, after each indexed batch
+        
+        At most max_buffer_bytes of chunk text and vector rows is held before
+        it is indexed, indexing never copies earlier rows, and questions can
+        be answered from the pages read so far. document_id is only set once
+        the last batch is indexed, so an abandoned stream is re-ingested by
+        the next load_document; a failed one is cleared.
+        """
+        doc_id = file_hash(pdf_file)
+        entry = self.document_cache.get(doc_id)
+        if entry is not None:
+            self.chunks = entry['chunks']
+            self.embeddings = entry['vector_index']
+            self.keyword_index = entry['keyword_index']
+            self.document_id = doc_id
+            yield len(self.chunks)
+            return
+        
+        if hasattr(pdf_file, 'seek'):
+            pdf_file.seek(0)
+        
+        loader = copy.copy(self.pdf_loader)
+        chunks = ChunkStore()
+        self.chunks = chunks
+        self.embeddings = None
+        self.keyword_index = None
+        self.document_id = None
+        try:
+            for batch in loader.stream_pdf(pdf_file, max_buffer_bytes):
+                # Indexes already contain the batch, so publish them before the chunks
+                self.embeddings = loader.vector_index
+                self.keyword_index = loader.keyword_index
+                chunks.extend(batch)
+                yield len(chunks)
+        except Exception as e:
+            # Drop the partial document rather than answer from part of it
+            if self.chunks is chunks:
+                self.chunks = ChunkStore()
+                self.embeddings = None
+                self.keyword_index = None
+            st.warning(f"⚠️ Streaming the PDF failed: {e}")
+            return
+        
+        if self.chunks is chunks:  # unless another document was loaded meanwhile
+            self.document_id = doc_id
+        if chunks:
+            self.document_cache.put(doc_id, {
+                'chunks': chunks,
+                'vector_index': self.embeddings,
+                'keyword_index': self.keyword_index
+            })
+    
+    def _rank_chunks(self, index, question: str, top_k: int) -> List[Tuple[int, float]]:
+        """
+        Top-k (chunk_index, score) pairs from an index, skipping chunks a
+        streaming ingest has indexed but not yet published
+        """
+        surplus = max(0, len(index) - len(self.chunks))
+        ranking = index.search(question, top_k=top_k + surplus)
+        return [(i, score) for i, score in ranking if i < len(self.chunks)][:top_k]
     
     def _store_answer_history(self, question: str, answer: str, source: str, chunk: Dict):
         """Store answer in history for confidence improvement"""
-        self.answer_history.append({
-            'timestamp': datetime.now(),
-            'question': question,
-            'answer': answer,
-            'source': source,
-            'chunk_text': chunk['text'][:200],  # Store first 200 chars for analysis
-            'chunk_page': chunk['page']
-        })
-        
-        # Keep only last 50 answers to prevent memory bloat
-        if len(self.answer_history) > 50:
-            self.answer_history = self.answer_history[-50:]
+        with self._history_lock:
+            self.answer_history.append({
+                'timestamp': datetime.now(),
+                'document_id': self.document_id,
+                'question': question,
+                'answer': answer,
+                'source': source,
+                'chunk_text': chunk['text'][:200],  # Store first 200 chars for analysis
+                'chunk_page': chunk['page']
+            })
+            
+            # Keep only last 50 answers to prevent memory bloat
+            if len(self.answer_history) > 50:
+                self.answer_history = self.answer_history[-50:]
     
     def _find_best_chunk(self, question: str) -> Dict[str, any]:
         """Find the most relevant chunk using semantic similarity"""
+        return self._retrieve(question)[0]
+    
+    @traced('find_best_chunk')
+    def _retrieve(self, question: str) -> Tuple[Optional[Dict[str, any]], str]:
+        """
+        Pick the most relevant chunk with the retrieval cascade
+        Returns: (chunk or None, stage that decided it)
+        """
         if not self.chunks:
-            return None
+            return None, 'none'
         
-        if self.models:
-            # Use LLM for semantic similarity
-            return self._semantic_search(question)
+        if self.embeddings is not None and len(self.embeddings) >= len(self.chunks):
+            # Use the local vector index for semantic similarity
+            chunk, stage = self._semantic_search(question)
+        elif self.models:
+            # No index available, ask the LLM to pick a chunk
+            chunk, stage = self._llm_search(question)
         else:
             # Fallback to keyword search
-            return self._keyword_search(question)
+            chunk, stage = self._keyword_search(question), 'keyword'
+        
+        if chunk is None:
+            stage = 'none'
+        TRACER.current().set(stage=stage)
+        with self._stats_lock:
+            self.retrieval_stats[stage] += 1
+        return chunk, stage
     
-    def _semantic_search(self, question: str) -> Dict[str, any]:
-        """Use available LLM to find most relevant chunk"""
+    def _semantic_search(self, question: str) -> Tuple[Optional[Dict[str, any]], str]:
+        """
+        Rank every chunk against the local vector index, reranking the top
+        candidates with an LLM only when the leaders are too close to call
+        """
+        ranking = [(i, score) for i, score in self._rank_chunks(self.embeddings, question, top_k=self.rerank_top_k) if score > 0]
+        if not ranking:
+            # No vocabulary overlap at all, fall back to keyword search
+            return self._keyword_search(question), 'keyword'
+        
+        best, best_score = ranking[0]
+        runner_up_score = ranking[1][1] if len(ranking) > 1 else 0.0
+        if not self.models or (best_score - runner_up_score) / best_score >= self.rerank_margin:
+            return self.chunks[best], 'local'
+        
+        chunk, stage = self._llm_search(question, [i for i, _ in ranking], fallback=False)
+        if chunk is None:
+            return self.chunks[best], 'local_fallback'
+        return chunk, stage
+    
+    def _llm_search(self, question: str, candidates: Optional[List[int]] = None,
+                    fallback: bool = True) -> Tuple[Optional[Dict[str, any]], str]:
+        """
+        Use available LLM to find the most relevant chunk among candidates
+        (chunk indexes, defaulting to the first 10 chunks)
+        Returns: (chunk, stage); with fallback=False, (None, '') if every model failed
+        """
+        if candidates is None:
+            candidates = list(range(min(10, len(self.chunks))))  # Limit to first 10 chunks for speed
+            stage = 'llm'
+        else:
+            stage = 'llm_rerank'
+        
         try:
-            # Create a prompt to find the most relevant chunk
-            chunks_text = "\n\n".join([
-                f"Chunk {i+1} (Page {chunk['page']}): {chunk['text'][:200]}..."
-                for i, chunk in enumerate(self.chunks[:10])  # Limit to first 10 chunks for speed
-            ])
+            texts = [self.chunks[i]['text'] for i in candidates]
+            sources = [self.pdf_loader.get_chunk_source(self.chunks[i]) for i in candidates]
             
-            prompt = f"""
+            def build_prompt(model_name: str) -> str:
+                # Share the model's search budget evenly between the candidate previews
+                budget = min(self.search_context_tokens, self._context_budget(model_name, 10))
+                previews = [self.pdf_loader.tokenizer.truncate(text, max(50, budget // len(candidates))) for text in texts]
+                chunks_text = "\n\n".join([
+                    f"Chunk {n+1} ({source}): {preview}{'...' if len(preview) < len(text) else ''}"
+                    for n, (source, preview, text) in enumerate(zip(sources, previews, texts))
+                ])
+                
+                return f"""
             Given this question: "{question}"
             
             And these document chunks:
             {chunks_text}
             
-            Which chunk (1-{min(10, len(self.chunks))}) is most relevant to answering the question?
+            Which chunk (1-{len(candidates)}) is most relevant to answering the question?
             
             IMPORTANT: Respond with ONLY the chunk number (1, 2, 3, etc.) and nothing else.
             Do not provide explanations, reasoning, or additional text.
             """
             
-            # Try each model in order
-            for model_name, model in self.models.items():
-                try:
-                    response_text = ""
-                    
-                    if model_name == 'gemini':
-                        response = model.generate_content(prompt)
-                        response_text = response.text.strip()
-                    elif model_name == 'openai':
-                        response = openai.ChatCompletion.create(
-                            model=model,
-                            messages=[{"role": "user", "content": prompt}]
-                        )
-                        response_text = response.choices[0].message.content.strip()
-                    elif model_name == 'groq':
-                        response = model.chat.completions.create(
-                            model="llama3-8b-8192",
-                            messages=[{"role": "user", "content": prompt}]
-                        )
-                        response_text = response.choices[0].message.content.strip()
-                    elif model_name == 'cohere':
-                        response = model.generate(
-                            model='command',
-                            prompt=prompt,
-                            max_tokens=10
-                        )
-                        response_text = response.generations[0].text.strip()
-                    
-                    # Extract number from response (handle cases where model adds extra text)
-                    import re
-                    number_match = re.search(r'\b(\d+)\b', response_text)
-                    if number_match:
-                        chunk_num = int(number_match.group(1)) - 1
+            def parse_chunk_number(model_name: str, response_text: str) -> Optional[int]:
+                # Extract number from response (handle cases where model adds extra text)
+                number_match = re.search(r'\b(\d+)\b', response_text)
+                if number_match:
+                    chunk_num = int(number_match.group(1)) - 1
+                else:
+                    # Fallback: try to parse the first number found
+                    numbers = re.findall(r'\d+', response_text)
+                    if numbers:
+                        chunk_num = int(numbers[0]) - 1
                     else:
-                        # Fallback: try to parse the first number found
-                        numbers = re.findall(r'\d+', response_text)
-                        if numbers:
-                            chunk_num = int(numbers[0]) - 1
-                        else:
-                            # If we can't parse a number, log the issue and continue to next model
-                            st.warning(f"⚠️ {model_name} returned unparseable response: '{response_text[:100]}...'")
-                            continue
-                    
-                    # Validate chunk number
-                    if 0 <= chunk_num < len(self.chunks):
-                        return self.chunks[chunk_num]
-                    else:
-                        st.warning(f"⚠️ {model_name} returned invalid chunk number: {chunk_num + 1}")
-                        continue
-                        
-                except Exception as e:
-                    st.warning(f"⚠️ {model_name} search failed: {e}")
-                    continue
+                        # If we can't parse a number, log the issue and continue to next model
+                        st.warning(f"⚠️ {model_name} returned unparseable response: '{response_text[:100]}...'")
+                        return None
+                
+                # Validate chunk number
+                if 0 <= chunk_num < len(candidates):
+                    return chunk_num
+                st.warning(f"⚠️ {model_name} returned invalid chunk number: {chunk_num + 1}")
+                return None
+            
+            chunk_num = self._ask_models(build_prompt, 10, parse_chunk_number, "search")
+            if chunk_num is not None:
+                return self.chunks[candidates[chunk_num]], stage
             
         except Exception as e:
             st.warning(f"⚠️ Semantic search failed: {e}")
         
+        if not fallback:
+            return None, ''
+        
         # If all LLM models fail, fall back to keyword search
         st.info("ℹ️ Falling back to keyword search due to LLM issues")
-        return self._keyword_search(question)
+        return self._keyword_search(question), 'keyword'
     
-    def _keyword_search(self, question: str) -> Dict[str, any]:
-        """Enhanced keyword-based search as fallback"""
-        question_lower = question.lower()
-        
-        # Extract meaningful keywords (remove common words)
-        common_words = {'do', 'you', 'what', 'how', 'when', 'where', 'why', 'is', 'are', 'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'your', 'have', 'does', 'can', 'will', 'should', 'would', 'could', 'does', 'has', 'had', 'been', 'being', 'this', 'that', 'these', 'those', 'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'he', 'him', 'his', 'himself', 'she', 'her', 'hers', 'herself', 'it', 'its', 'itself', 'they', 'them', 'their', 'theirs', 'themselves'}
+    def _ask_models(self, prompt: Union[str, Callable[[str], str]], max_tokens: int,
+                    parse: Callable[[str, str], any], purpose: str):
+        """
+        Send a prompt down the provider fallback chain
+        prompt is a string, or prompt(model_name) builds one sized for that model
+        parse(model_name, response_text) returns the parsed value, or None to try the next provider
+        Returns: the first parsed value, or None if every provider failed
+        """
+        if not callable(prompt):
+            prompt = lambda model_name, text=prompt: text
         
-        # Extract security-specific keywords
-        security_keywords = ['encrypt', 'security', 'access', 'control', 'backup', 'disaster', 'recovery', 'incident', 'response', 'policy', 'procedure', 'compliance', 'audit', 'monitor', 'log', 'authentication', 'authorization', 'confidentiality', 'integrity', 'availability', 'data', 'protection', 'privacy', 'gdpr', 'hipaa', 'soc', 'iso', 'vulnerability', 'patch', 'update', 'firewall', 'network', 'system', 'user', 'password', 'mfa', '2fa', 'multi-factor']
+        if self.hedge_delay > 0 and len(self._available_models()) > 1:
+            return self._ask_models_hedged(prompt, max_tokens, parse, purpose)
         
-        # Get question keywords
-        question_words = [word for word in question_lower.split() if word not in common_words and len(word) > 2]
+        # Try each healthy model in order
+        for model_name, model in self._available_models():
+            try:
+                value = parse(model_name, self._complete(model_name, model, prompt(model_name), max_tokens))
+                if value is not None:
+                    return value
+            except Exception as e:
+                st.warning(f"⚠️ {model_name} {purpose} failed: {e}")
+                continue
+        return None
+    
+    def _ask_models_hedged(self, prompt: Callable[[str], str], max_tokens: int, parse: Callable[[str, str], any], purpose: str):
+        """Race providers: start the next one whenever the current one exceeds the hedge delay"""
+        # Each candidate runs in a copy of the caller's context so its spans join the caller's trace
+        candidates = [
+            (model_name, lambda model_name=model_name, model=model, context=contextvars.copy_context(): context.run(
+                lambda: parse(model_name, self._complete(model_name, model, prompt(model_name), max_tokens))
+            ))
+            for model_name, model in self._available_models()
+        ]
+        winner, value, errors = hedged_call(candidates, self._hedge_executor, self.hedge_delay, self.provider_timeouts, self.default_timeout)
+        for model_name, error in errors:
+            st.warning(f"⚠️ {model_name} {purpose} failed: {error}")
+        return value if winner else None
+    
+    def _context_budget(self, model_name: str, max_tokens: int) -> int:
+        """Tokens of document context a prompt to this model may carry"""
+        window = MODEL_CONTEXT_WINDOWS.get(model_name, min(MODEL_CONTEXT_WINDOWS.values()))
+        return max(0, min(self.context_tokens, window - max_tokens - PROMPT_OVERHEAD_TOKENS))
+    
+    def _context_candidates(self, question: str, best_chunk: Dict[str, any]) -> List[Dict[str, any]]:
+        """The chosen chunk followed by the next best-ranked chunks, for context packing"""
+        index = self.embeddings if self.embeddings is not None and len(self.embeddings) >= len(self.chunks) else self.keyword_index
+        if index is None or self.context_candidates <= 1:
+            return [best_chunk]
         
-        # Add security keywords that match the question
-        for sec_keyword in security_keywords:
-            if sec_keyword in question_lower and sec_keyword not in question_words:
-                question_words.append(sec_keyword)
+        best_key = (best_chunk.get('document_id'), best_chunk['page'], best_chunk['start_char'])
+        candidates = [best_chunk]
+        for i, score in self._rank_chunks(index, question, top_k=self.context_candidates):
+            chunk = self.chunks[i]
+            if score > 0 and (chunk.get('document_id'), chunk['page'], chunk['start_char']) != best_key:
+                candidates.append(chunk)
+        return candidates[:self.context_candidates]
+    
+    def _available_models(self) -> List[Tuple[str, any]]:
+        """Providers in priority order, skipping any whose circuit breaker is open"""
+        return [
+            (model_name, model) for model_name, model in self.models.items()
+            if model_name not in self.breakers or self.breakers[model_name].is_available()
+        ]
+    
+    def provider_health(self) -> Dict[str, Dict[str, any]]:
+        """Circuit breaker state, failure rate and latency EWMA for each provider"""
+        return {model_name: breaker.snapshot() for model_name, breaker in self.breakers.items()}
+    
+    def _complete(self, model_name: str, model, prompt: str, max_tokens: int) -> str:
+        """Run a prompt through one provider, serving repeats from the response cache"""
+        return ''.join(self._complete_stream(model_name, model, prompt, max_tokens, stream=False))
+    
+    def _complete_stream(self, model_name: str, model, prompt: str, max_tokens: int,
+                         stream: bool = True) -> Iterator[str]:
+        """
+        Run a prompt through one provider as text deltas, serving repeats from
+        the response cache (as one delta); with stream=False the provider's
+        blocking call is used and its whole response is the only delta
+        """
+        cache_key = self.response_cache.make_key(
+            model_name, PROVIDERS[model_name].model_id if model_name in PROVIDERS else str(model), prompt, self.document_id, max_tokens
+        )
+        cached = self.response_cache.get(cache_key)
+        TRACER.count('rag_cache_requests_total', cache='response', result='miss' if cached is None else 'hit')
+        if cached is not None:
+            yield cached
+            return
         
-        if not question_words:
-            question_words = question_lower.split()
+        limit = self.provider_limits.get(model_name)
+        if limit is not None and not limit.acquire(timeout=self.provider_wait):
+            TRACER.count('rag_llm_errors_total', provider=model_name)
+            raise TimeoutError(f"{model_name}: no free request slot within {self.provider_wait:g}s (RAG_PROVIDER_WAIT)")
+        breaker = self.breakers.get(model_name)
+        if breaker and not breaker.try_acquire():
+            # Opened, or another request holds the half-open probe, since the provider list was built
+            if limit is not None:
+                limit.release()
+            raise RuntimeError(f"{model_name}: circuit breaker is {breaker.state}, request skipped")
+        parts = []
+        start = time.monotonic()
+        try:
+            with TRACER.span('llm_call', provider=model_name) as span:
+                for delta in self._model_deltas(model_name, model, prompt, max_tokens, stream):
+                    if stream and not parts:
+                        first_token = time.monotonic() - start
+                        span.set(time_to_first_token_ms=round(first_token * 1000, 3))
+                        TRACER.metrics.observe('rag_time_to_first_token_seconds', first_token, provider=model_name)
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            if breaker:
+                breaker.record_failure(time.monotonic() - start, e)
+            TRACER.count('rag_llm_errors_total', provider=model_name)
+            raise
+        finally:
+            if limit is not None:
+                limit.release()
+        if breaker:
+            breaker.record_success(time.monotonic() - start)
+        response_text = ''.join(parts).strip()
+        self._count_tokens(span, model_name, prompt, response_text)
+        if response_text:
+            self.response_cache.put(cache_key, response_text)
+    
+    def _model_deltas(self, model_name: str, model, prompt: str, max_tokens: int, stream: bool) -> Iterator[str]:
+        """Text deltas from one provider; blocking calls and backends without streaming send the whole response at once"""
+        backend = PROVIDERS.get(model_name)
+        if stream and backend is not None and backend.stream is not None:
+            timeout = self.provider_timeouts.get(model_name, self.default_timeout)
+            yield from backend.stream(model, backend.model_id, prompt, max_tokens, timeout)
+        else:
+            response_text = self._call_model(model_name, model, prompt, max_tokens)
+            if response_text:
+                yield response_text
+    
+    def _count_tokens(self, span, model_name: str, prompt: str, response_text: str):
+        """Record prompt and completion token counts of a provider call"""
+        tokenizer = get_tokenizer()
+        prompt_tokens = tokenizer.count(prompt)
+        completion_tokens = tokenizer.count(response_text or '')
+        span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        TRACER.count('rag_llm_tokens_total', prompt_tokens, provider=model_name, kind='prompt')
+        TRACER.count('rag_llm_tokens_total', completion_tokens, provider=model_name, kind='completion')
+    
+    def _call_model(self, model_name: str, model, prompt: str, max_tokens: int) -> str:
+        """Send a prompt to one provider and return the stripped response text"""
+        backend = PROVIDERS.get(model_name)
+        if backend is None:
+            return ""
+        timeout = self.provider_timeouts.get(model_name, self.default_timeout)
+        return backend.call(model, backend.model_id, prompt, max_tokens, timeout)
+    
+    @profiled('keyword_search')
+    def _keyword_search(self, question: str) -> Dict[str, any]:
+        """BM25 keyword search over the inverted index as fallback"""
+        if not self.chunks:
+            return None
         
-        best_score = 0
-        best_chunk = None
+        # Chunks set without going through the loader get indexed on first use
+        if self.keyword_index is None or len(self.keyword_index) < len(self.chunks):
+            self.keyword_index = self.pdf_loader.build_keyword_index(self.chunks)
         
-        for chunk in self.chunks:
-            chunk_text_lower = chunk['text'].lower()
-            
-            # Calculate keyword matches
-            keyword_matches = sum(1 for keyword in question_words if keyword in chunk_text_lower)
-            
-            # Bonus for security terminology matches
-            security_matches = sum(1 for sec_keyword in security_keywords if sec_keyword in chunk_text_lower)
-            security_bonus = security_matches * 0.5
-            
-            # Bonus for longer, more detailed chunks
-            length_bonus = min(0.5, len(chunk_text_lower) / 1000)
-            
-            total_score = keyword_matches + security_bonus + length_bonus
-            
-            if total_score > best_score:
-                best_score = total_score
-                best_chunk = chunk
+        ranking = self._rank_chunks(self.keyword_index, question, top_k=1)
+        if not ranking or ranking[0][1] <= 0:
+            return None
         
-        return best_chunk
+        return self.chunks[ranking[0][0]]
     
-    def _generate_answer(self, question: str, context: str) -> str:
-        """Generate answer using available LLM with context"""
-        if not self.models:
-            # Fallback: return context with some formatting
-            return f"Based on the document: {context[:300]}..."
+    def _answer_prompt(self, question: str, context: str,
+                       candidates: Optional[List[Dict[str, any]]] = None) -> Callable[[str], str]:
+        """Builds the answer prompt for a model, packing as many candidates as fit its context budget"""
+        packed = {}  # budget -> packed context, shared by models with the same budget
         
-        try:
-            prompt = f"""
+        def build_prompt(model_name: str) -> str:
+            budget = self._context_budget(model_name, ANSWER_MAX_TOKENS)
+            if not candidates:
+                model_context = context
+            elif budget in packed:
+                model_context = packed[budget]
+            else:
+                model_context = packed[budget] = format_context(pack_chunks(candidates, budget))
+            
+            return f"""
             Context from security policy document:
-            {context}
+            {model_context}
             
             Question: {question}
             
@@ -265,36 +980,27 @@ class RAGEngine:
             If the context doesn't contain enough information to answer the question, 
             say "The document doesn't contain enough information to answer this question."
             """
-            
-            # Try each model in order
-            for model_name, model in self.models.items():
-                try:
-                    if model_name == 'gemini':
-                        response = model.generate_content(prompt)
-                        return response.text.strip()
-                    elif model_name == 'openai':
-                        response = openai.ChatCompletion.create(
-                            model=model,
-                            messages=[{"role": "user", "content": prompt}]
-                        )
-                        return response.choices[0].message.content.strip()
-                    elif model_name == 'groq':
-                        response = model.chat.completions.create(
-                            model="llama3-8b-8192",
-                            messages=[{"role": "user", "content": prompt}]
-                        )
-                        return response.choices[0].message.content.strip()
-                    elif model_name == 'cohere':
-                        response = model.generate(
-                            model='command',
-                            prompt=prompt,
-                            max_tokens=200
-                        )
-                        return response.generations[0].text.strip()
-                        
-                except Exception as e:
-                    st.warning(f"⚠️ {model_name} answer generation failed: {e}")
-                    continue
+        
+        return build_prompt
+    
+    @traced('generate_answer')
+    def _generate_answer(self, question: str, context: str, candidates: Optional[List[Dict[str, any]]] = None) -> str:
+        """
+        Generate answer using available LLM with context
+        When ranked candidate chunks are given, each model gets as many of
+        them as fit its context budget instead of the single context string
+        """
+        if not self.models:
+            # Fallback: return context with some formatting
+            return f"Based on the document: {context[:300]}..."
+        
+        try:
+            answer = self._ask_models(
+                self._answer_prompt(question, context, candidates), ANSWER_MAX_TOKENS,
+                lambda model_name, text: text or None, "answer generation"
+            )
+            if answer is not None:
+                return answer
             
         except Exception as e:
             return f"Error generating answer: {e}. Here's the relevant context: {context[:200]}..."
@@ -302,6 +1008,7 @@ class RAGEngine:
         # If all models fail, return context
         return f"Based on the document: {context[:300]}..."
     
+    @profiled('coverage_confidence')
     def get_coverage_confidence(self, question: str) -> Tuple[float, str]:
         """Enhanced confidence scoring with multiple factors"""
         if not self.chunks:
@@ -318,6 +1025,8 @@ class RAGEngine:
         
         return final_confidence, self._generate_confidence_reasoning(confidence_factors)
     
+    @traced('confidence')
+    @profiled('confidence_factors')
     def _calculate_confidence_factors(self, question: str, chunk: Dict) -> Dict[str, float]:
         """Calculate multiple confidence factors"""
         chunk_text = chunk['text'].lower()
@@ -449,21 +1158,57 @@ class RAGEngine:
         
         return " | ".join(reasoning_parts)
 
-# Global RAG engine instance
+# Global RAG engine instance, shared by every session in the process
 _rag_engine = None
+_rag_engine_lock = threading.Lock()
 
-def load_and_query(pdf_file, question: str) -> Tuple[str, str]:
-    """Convenience function for the main app"""
+def get_engine() -> RAGEngine:
+    """The process-wide engine; use get_engine().new_session() for per-user state"""
     global _rag_engine
     if _rag_engine is None:
-        _rag_engine = RAGEngine()
-    
-    return _rag_engine.load_and_query(pdf_file, question)
+        with _rag_engine_lock:
+            if _rag_engine is None:
+                _rag_engine = RAGEngine()
+    return _rag_engine
 
-def get_coverage_confidence(question: str) -> Tuple[float, str]:
-    """Get confidence score and reasoning for a question"""
-    global _rag_engine
+def load_and_query(pdf_file, question: str, session: Optional[RAGEngine] = None) -> Tuple[str, str]:
+    """Convenience function for the main app"""
+    return (session or get_engine()).load_and_query(pdf_file, question)
+
+def query(pdf_file, question: str, session: Optional[RAGEngine] = None) -> QueryResult:
+    """Answer a question and score its confidence from one retrieval"""
+    return (session or get_engine()).query(pdf_file, question)
+
+async def load_and_query_async(pdf_file, question: str, session: Optional[RAGEngine] = None) -> Tuple[str, str]:
+    """Async convenience function for services running on an event loop"""
+    return await (session or get_engine()).load_and_query_async(pdf_file, question)
+
+async def query_async(pdf_file, question: str, session: Optional[RAGEngine] = None) -> QueryResult:
+    """Async counterpart of query"""
+    return await (session or get_engine()).query_async(pdf_file, question)
+
+def query_stream(pdf_file, question: str, session: Optional[RAGEngine] = None) -> AnswerStream:
+    """Answer a question as a stream of text deltas; the QueryResult is on .result once it ends"""
+    return (session or get_engine()).query_stream(pdf_file, question)
+
+def get_provider_health() -> Dict[str, Dict[str, any]]:
+    """Health snapshot of each configured provider (empty before the engine starts)"""
     if _rag_engine is None:
+        return {}
+    return _rag_engine.provider_health()
+
+def get_coverage_confidence(question: str, session: Optional[RAGEngine] = None) -> Tuple[float, str]:
+    """Get confidence score and reasoning for a question"""
+    engine = session or _rag_engine
+    if engine is None:
+        return 0.0, "RAG engine not initialized"
+    
+    return engine.get_coverage_confidence(question)
+
+async def get_coverage_confidence_async(question: str, session: Optional[RAGEngine] = None) -> Tuple[float, str]:
+    """Async counterpart of get_coverage_confidence"""
+    engine = session or _rag_engine
+    if engine is None:
         return 0.0, "RAG engine not initialized"
     
-    return _rag_engine.get_coverage_confidence(question) 
\ No newline at end of file
+    return await engine.get_coverage_confidence_async(question)
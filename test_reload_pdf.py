@@ -0,0 +1,63 @@
+"""
+Incremental reload must index a revision exactly like a full load,
+including revisions that repeat an unchanged page
+Run: python -m pytest -q test_reload_pdf.py
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from benchmark import synthetic_pages, write_pdf
+from utils.pdf_loader import PDFLoader
+
+QUESTIONS = [
+    "Do you encrypt data at rest?",
+    "How often are access reviews performed?",
+    "Is there an incident response plan?",
+]
+
+
+def _pdf_bytes(pages) -> bytes:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'policy.pdf')
+        write_pdf(path, pages)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def test_reload_with_repeated_page_matches_full_load():
+    pages = synthetic_pages(6, lines_per_page=12)
+    base_bytes = _pdf_bytes(pages)
+    # Page 2 appears twice, page 4 is dropped and a new page is appended
+    revision_bytes = _pdf_bytes([pages[0], pages[1], pages[2], pages[1], pages[4], pages[5],
+                                 synthetic_pages(7, seed=1, lines_per_page=12)[6]])
+
+    loader = PDFLoader(workers=1)
+    base_chunks = loader.load_pdf(base_bytes)
+    previous = {
+        'chunks': base_chunks,
+        'vector_index': loader.vector_index,
+        'keyword_index': loader.keyword_index,
+        'page_hashes': loader.page_hashes,
+    }
+
+    reloaded = PDFLoader(workers=1)
+    chunks = reloaded.reload_pdf(revision_bytes, previous)
+    assert reloaded.changed_pages == [7]
+
+    full = PDFLoader(workers=1)
+    full_chunks = full.load_pdf(revision_bytes)
+
+    assert len(chunks) == len(full_chunks)
+    assert [chunks.text(i) for i in range(len(chunks))] == [full_chunks.text(i) for i in range(len(full_chunks))]
+    assert len(reloaded.vector_index) == len(full.vector_index)
+    assert len(reloaded.keyword_index) == len(full.keyword_index)
+    for question in QUESTIONS:
+        assert np.allclose(reloaded.vector_index.scores(question), full.vector_index.scores(question), atol=1e-6)
+        assert np.allclose(reloaded.keyword_index.scores(question), full.keyword_index.scores(question), atol=1e-6)
+
+
+if __name__ == '__main__':
+    test_reload_with_repeated_page_matches_full_load()
+    print("ok")
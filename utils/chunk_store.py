@@ -0,0 +1,128 @@
+import sys
+from array import array
+from collections.abc import Mapping
+from typing import Iterator, List, Tuple
+
+from utils.tokenizer import get_tokenizer
+
+CHUNK_FIELDS = ('text', 'page', 'start_char', 'end_char', 'tokens_estimate')
+
+
+class ChunkView(Mapping):
+    """
+    Read-only, dict-like view of one chunk in a ChunkStore.
+
+    Supports chunk['text'], chunk['page'], chunk['start_char'],
+    chunk['end_char'] and chunk['tokens_estimate'] like the old chunk dicts,
+    but holds only a reference to the store and an index.
+    """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: 'ChunkStore', index: int):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, key: str):
+        store, i = self._store, self._index
+        if key == 'text':
+            return store.text(i)
+        if key == 'page':
+            return int(store.pages[i])
+        if key == 'start_char':
+            return int(store.starts[i])
+        if key == 'end_char':
+            return int(store.ends[i])
+        if key == 'tokens_estimate':
+            return get_tokenizer().count(store.text(i))
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(CHUNK_FIELDS)
+
+    def __len__(self) -> int:
+        return len(CHUNK_FIELDS)
+
+    def __repr__(self) -> str:
+        return f"ChunkView(page={self['page']}, start_char={self['start_char']}, end_char={self['end_char']})"
+
+
+class ChunkStore:
+    """
+    Columnar storage for a document's chunks.
+
+    Each page's normalized text is stored once; chunks are rows of typed
+    arrays (page number, page slot, start and end offsets) into those page
+    buffers, so the text shared by overlapping chunks is never duplicated.
+    Chunk text is sliced out of its page on access and not retained.
+    Stores opened with utils.index_store are memory-mapped and read-only.
+    """
+
+    def __init__(self):
+        self.page_texts: List[str] = []
+        self.pages = array('i')       # page number of each chunk
+        self.page_slots = array('i')  # index into page_texts of each chunk
+        self.starts = array('i')      # start offset within the page text
+        self.ends = array('i')        # end offset within the page text
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ChunkView(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('chunk index out of range')
+        return ChunkView(self, index)
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        for i in range(len(self)):
+            yield ChunkView(self, i)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ChunkStore, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by page text and offset arrays"""
+        if hasattr(self.page_texts, 'nbytes'):
+            text_bytes = self.page_texts.nbytes
+        else:
+            text_bytes = sum(sys.getsizeof(text) for text in self.page_texts)
+        arrays = (self.pages, self.page_slots, self.starts, self.ends)
+        return text_bytes + sum(a.itemsize * len(a) for a in arrays)
+
+    def text(self, index: int) -> str:
+        """Text of one chunk"""
+        page_text = self.page_texts[self.page_slots[index]]
+        return page_text[self.starts[index]:self.ends[index]].strip()
+
+    def add_page(self, page_num: int, text: str, bounds: List[Tuple[int, int]]):
+        """Store one page's normalized text and the (start, end) offsets of its chunks"""
+        if not bounds:
+            return
+        slot = len(self.page_texts)
+        self.page_texts.append(text)
+        # starts defines len(self), so it is appended last for concurrent readers
+        for start, end in bounds:
+            self.pages.append(page_num)
+            self.page_slots.append(slot)
+            self.ends.append(end)
+            self.starts.append(start)
+
+    def extend(self, other: 'ChunkStore'):
+        """Append all chunks of another store, e.g. a later page range"""
+        slot_offset = len(self.page_texts)
+        self.page_texts.extend(other.page_texts)
+        self.pages.extend(other.pages)
+        self.page_slots.extend(array('i', (slot + slot_offset for slot in other.page_slots)))
+        self.ends.extend(other.ends)
+        self.starts.extend(other.starts)
+
+    def texts(self) -> List[str]:
+        """Text of every chunk, for building indexes"""
+        return [self.text(i) for i in range(len(self))]
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker with latency tracking for one provider.
+
+    Outcomes are kept in a sliding time window. Once at least min_requests
+    calls are in the window and the failure rate reaches failure_threshold,
+    the breaker opens and the provider is skipped. After cooldown seconds a
+    single probe request is let through (half-open): success closes the
+    breaker, failure opens it again for another cooldown.
+    """
+
+    def __init__(self, name: str, window_seconds: float = 60.0, min_requests: int = 3,
+                 failure_threshold: float = 0.5, cooldown: float = 30.0, ewma_alpha: float = 0.2):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.ewma_alpha = ewma_alpha
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.latency_ewma = None  # seconds
+        self.last_error = None
+        self.total_requests = 0
+        self.total_failures = 0
+        self._outcomes = deque()  # (timestamp, succeeded)
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def _probe_free(self, now: float) -> bool:
+        """Whether a request may go out now; moves an open breaker to half-open after its cooldown (lock held)"""
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self._probe_started = None
+        if self.state == HALF_OPEN:
+            # One probe at a time; a probe that never reported back is retried after a cooldown
+            return self._probe_started is None or now - self._probe_started >= self.cooldown
+        return self.state == CLOSED
+
+    def is_available(self) -> bool:
+        """Whether a request may be sent to this provider right now (claims nothing, see try_acquire)"""
+        with self._lock:
+            return self._probe_free(time.monotonic())
+
+    def try_acquire(self) -> bool:
+        """
+        Claim the right to send one request: always granted when closed, when
+        half-open only to the single caller that takes the probe slot
+        Returns: False if the breaker is open or another caller holds the probe
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not self._probe_free(now):
+                return False
+            if self.state == HALF_OPEN:
+                self._probe_started = now
+            return True
+
+    def _record_latency(self, latency: float):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = self.ewma_alpha * latency + (1 - self.ewma_alpha) * self.latency_ewma
+
+    def record_success(self, latency: float):
+        with self._lock:
+            now = time.monotonic()
+            self.total_requests += 1
+            self._record_latency(latency)
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self._outcomes.clear()
+            self._outcomes.append((now, True))
+            self._prune(now)
+
+    def record_failure(self, latency: float, error: Optional[Exception] = None):
+        with self._lock:
+            now = time.monotonic()
+            self.total_requests += 1
+            self.total_failures += 1
+            self._record_latency(latency)
+            self.last_error = str(error) if error else None
+            self._outcomes.append((now, False))
+            self._prune(now)
+
+            if self.state == HALF_OPEN or (
+                len(self._outcomes) >= self.min_requests and self._failure_rate() >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened_at = now
+                self._probe_started = None
+
+    def snapshot(self) -> Dict[str, any]:
+        """Current health of the provider"""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            return {
+                'state': self.state,
+                'failure_rate': round(self._failure_rate(), 3),
+                'window_requests': len(self._outcomes),
+                'latency_ewma_ms': round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+                'retry_in_s': round(max(0.0, self.cooldown - (now - self.opened_at)), 1) if self.state == OPEN else 0.0,
+                'total_requests': self.total_requests,
+                'total_failures': self.total_failures,
+                'last_error': self.last_error
+            }
@@ -0,0 +1,78 @@
+from typing import Callable, Dict, List
+
+from utils.tokenizer import get_tokenizer
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count with the configured tokenizer (RAG_TOKENIZER)"""
+    return get_tokenizer().count(text)
+
+
+def merge_chunks(chunks: List[Dict[str, any]]) -> List[Dict[str, any]]:
+    """
+    Merge ranked chunks that overlap on the same page (of the same document)
+    into single spans, so text repeated by PDFLoader.overlap is sent once
+    Returns: [{'document', 'page', 'start_char', 'end_char', 'text', 'rank'}]
+    ordered by the best-ranked chunk each span contains
+    """
+    by_page = {}
+    for rank, chunk in enumerate(chunks):
+        by_page.setdefault((chunk.get('document_id'), chunk.get('document'), chunk['page']), []).append(
+            (chunk['start_char'], chunk['end_char'], chunk['text'], rank)
+        )
+
+    spans = []
+    for (_, document, page), items in by_page.items():
+        items.sort()
+        current = None
+        for start, end, text, rank in items:
+            if current is not None and start < current['end_char']:
+                if end > current['end_char']:
+                    # Chunk text is a slice of the page ending at end_char, so its tail is the new part
+                    new_chars = end - current['end_char']
+                    current['text'] += text[-new_chars:] if new_chars < len(text) else text
+                    current['end_char'] = end
+                current['rank'] = min(current['rank'], rank)
+            else:
+                current = {'document': document, 'page': page, 'start_char': start, 'end_char': end, 'text': text, 'rank': rank}
+                spans.append(current)
+
+    spans.sort(key=lambda span: span['rank'])
+    return spans
+
+
+def pack_chunks(chunks: List[Dict[str, any]], budget_tokens: int,
+                estimate: Callable[[str], int] = estimate_tokens) -> List[Dict[str, any]]:
+    """
+    Fill a token budget with ranked chunks (best first), skipping any that
+    don't fit and counting overlapping text once
+    Returns: merged spans (see merge_chunks); the best chunk is truncated if
+    it alone exceeds the budget
+    """
+    selected = []
+    spans = []
+    for chunk in chunks:
+        candidate = merge_chunks(selected + [chunk])
+        if sum(estimate(span['text']) for span in candidate) <= budget_tokens:
+            selected.append(chunk)
+            spans = candidate
+
+    if not spans and chunks and budget_tokens > 0:
+        best = chunks[0]
+        spans = [{
+            'document': best.get('document'),
+            'page': best['page'],
+            'start_char': best['start_char'],
+            'end_char': best['end_char'],
+            'text': get_tokenizer().truncate(best['text'], budget_tokens),
+            'rank': 0
+        }]
+    return spans
+
+
+def format_context(spans: List[Dict[str, any]]) -> str:
+    """Render packed spans as prompt context, labelled with their document and page"""
+    return "\n\n".join(
+        f"[{span['document']}, Page {span['page']}] {span['text']}" if span.get('document') else f"[Page {span['page']}] {span['text']}"
+        for span in spans
+    )
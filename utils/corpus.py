@@ -0,0 +1,199 @@
+import hashlib
+import re
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Mentions that tag a document with a framework (keys of SECURITY_FRAMEWORKS)
+FRAMEWORK_PATTERNS = {
+    'SOC2': re.compile(r'\bSOC\s?2\b|trust services criteria', re.IGNORECASE),
+    'ISO27001': re.compile(r'\bISO(?:/IEC)?\s?27001\b|statement of applicability', re.IGNORECASE),
+    'GDPR': re.compile(r'\bGDPR\b|general data protection regulation', re.IGNORECASE),
+    'HIPAA': re.compile(r'\bHIPAA\b|protected health information', re.IGNORECASE),
+}
+
+
+def detect_frameworks(texts: Iterable[str]) -> List[str]:
+    """Frameworks a document mentions, in FRAMEWORK_PATTERNS order"""
+    found = set()
+    for text in texts:
+        for key, pattern in FRAMEWORK_PATTERNS.items():
+            if key not in found and pattern.search(text):
+                found.add(key)
+        if len(found) == len(FRAMEWORK_PATTERNS):
+            break
+    return [key for key in FRAMEWORK_PATTERNS if key in found]
+
+
+class CorpusChunk(Mapping):
+    """A document chunk with the id and name of the document it came from"""
+
+    __slots__ = ('_chunk', '_document_id', '_document')
+
+    def __init__(self, chunk: Mapping, document_id: str, document: str):
+        self._chunk = chunk
+        self._document_id = document_id
+        self._document = document
+
+    def __getitem__(self, key: str):
+        if key == 'document_id':
+            return self._document_id
+        if key == 'document':
+            return self._document
+        return self._chunk[key]
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._chunk
+        yield 'document_id'
+        yield 'document'
+
+    def __len__(self) -> int:
+        return len(self._chunk) + 2
+
+    def __repr__(self) -> str:
+        return f"CorpusChunk(document={self._document!r}, page={self['page']}, start_char={self['start_char']})"
+
+
+class ShardedChunks:
+    """
+    Read-only sequence of the chunks of several documents, numbered one
+    after another in shard order; chunk i of shard s has id offsets[s] + i
+    """
+
+    def __init__(self, shards: List[Tuple[str, str, any]]):
+        self.shards = shards  # (document_id, name, chunks)
+        self.offsets = [0]
+        for _, _, chunks in shards:
+            self.offsets.append(self.offsets[-1] + len(chunks))
+
+    def __len__(self) -> int:
+        return self.offsets[-1]
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """(shard number, chunk index within the shard) of a corpus-wide chunk id"""
+        shard = bisect_right(self.offsets, index) - 1
+        return shard, index - self.offsets[shard]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('chunk index out of range')
+        shard, local = self.locate(index)
+        document_id, name, chunks = self.shards[shard]
+        return CorpusChunk(chunks[local], document_id, name)
+
+    def __iter__(self) -> Iterator[CorpusChunk]:
+        for document_id, name, chunks in self.shards:
+            for chunk in chunks:
+                yield CorpusChunk(chunk, document_id, name)
+
+
+class ShardedIndex:
+    """
+    One VectorIndex or KeywordIndex per document, searched together: each
+    shard returns its own top-k and the results are merged by score.
+    Scores use each shard's own statistics (IDF, average length).
+    """
+
+    def __init__(self, indexes: List, offsets: List[int]):
+        self.indexes = indexes
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return sum(len(index) for index in self.indexes)
+
+    def scores(self, query: str) -> np.ndarray:
+        if not self.indexes:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate([index.scores(query) for index in self.indexes])
+
+    def search(self, query: str, top_k: int = None) -> List[Tuple[int, float]]:
+        """
+        Rank chunks of every shard
+        Returns: List of (corpus_chunk_id, score), best first
+        """
+        ranking = []
+        for index, offset in zip(self.indexes, self.offsets):
+            ranking.extend((offset + i, score) for i, score in index.search(query, top_k=top_k))
+        ranking.sort(key=lambda item: -item[1])
+        return ranking if top_k is None else ranking[:top_k]
+
+
+class Corpus:
+    """
+    Set of indexed documents that can be searched together.
+
+    Each document is one shard holding the chunk store and indexes produced
+    by PDFLoader (usually straight from the DocumentCache), so adding or
+    removing a document never rebuilds the others. view() selects the shards
+    to search by document or by framework tag.
+    """
+
+    def __init__(self):
+        self._documents: OrderedDict = OrderedDict()  # document_id -> info
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, document_id: str) -> bool:
+        return document_id in self._documents
+
+    def add(self, document_id: str, name: str, entry: Dict[str, any], frameworks: Optional[List[str]] = None):
+        """Add (or replace) a document; frameworks are detected from its text if not given"""
+        if frameworks is None:
+            frameworks = detect_frameworks(chunk['text'] for chunk in entry['chunks'])
+        with self._lock:
+            self._documents[document_id] = {
+                'name': name or document_id[:12],
+                'frameworks': [key.upper() for key in frameworks],
+                'entry': entry
+            }
+
+    def remove(self, document: str) -> bool:
+        """Remove a document by id or name; returns whether one was removed"""
+        with self._lock:
+            for document_id, info in list(self._documents.items()):
+                if document in (document_id, info['name']):
+                    del self._documents[document_id]
+                    return True
+        return False
+
+    def documents(self) -> List[Dict[str, any]]:
+        """Id, name, framework tags and chunk count of every document"""
+        with self._lock:
+            return [
+                {'document_id': document_id, 'name': info['name'], 'frameworks': list(info['frameworks']),
+                 'chunks': len(info['entry']['chunks'])}
+                for document_id, info in self._documents.items()
+            ]
+
+    def view(self, documents: Optional[List[str]] = None,
+             frameworks: Optional[List[str]] = None) -> Tuple[str, ShardedChunks, ShardedIndex, ShardedIndex]:
+        """
+        Chunks and indexes of the selected documents (by id or name) and/or
+        documents tagged with any of the given frameworks; all if neither is given
+        Returns: (view_id, chunks, vector_index, keyword_index); view_id
+        identifies the selected set, e.g. for response cache keys
+        """
+        wanted_frameworks = {key.upper() for key in frameworks or []}
+        with self._lock:
+            selected = [
+                (document_id, info) for document_id, info in self._documents.items()
+                if (not documents or document_id in documents or info['name'] in documents)
+                and (not wanted_frameworks or wanted_frameworks & set(info['frameworks']))
+            ]
+
+        chunks = ShardedChunks([(document_id, info['name'], info['entry']['chunks']) for document_id, info in selected])
+        offsets = chunks.offsets[:-1]
+        vector_index = ShardedIndex([info['entry']['vector_index'] for _, info in selected], offsets)
+        keyword_index = ShardedIndex([info['entry']['keyword_index'] for _, info in selected], offsets)
+        view_id = hashlib.sha256('\0'.join(document_id for document_id, _ in selected).encode('utf-8')).hexdigest()
+        return view_id, chunks, vector_index, keyword_index
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from utils import index_store
+
+
+def document_hash(pdf_bytes: bytes) -> str:
+    """Content address of a PDF: SHA-256 of its raw bytes"""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def file_hash(pdf_file, block_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 of a PDF given as bytes, a path or a file object, read in blocks
+    so large files don't have to be held in memory to be hashed
+    """
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return document_hash(pdf_file)
+    if hasattr(pdf_file, 'getbuffer'):
+        return hashlib.sha256(pdf_file.getbuffer()).hexdigest()
+
+    digest = hashlib.sha256()
+    if isinstance(pdf_file, str):
+        with open(pdf_file, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    else:
+        pdf_file.seek(0)
+        for block in iter(lambda: pdf_file.read(block_size), b''):
+            digest.update(block)
+        pdf_file.seek(0)
+    return digest.hexdigest()
+
+
+def entry_key(doc_id: str, settings: str = '') -> str:
+    """
+    Cache key of a document chunked with the given settings (see
+    PDFLoader.chunking_settings), so changing them never serves old chunks
+    """
+    if not settings:
+        return doc_id
+    return f"{doc_id}-{hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]}"
+
+
+def entry_size(entry: Dict[str, any]) -> int:
+    """
+    Approximate resident size of a cached document in bytes
+    """
+    chunks = entry.get('chunks', [])
+    if hasattr(chunks, 'nbytes'):
+        size = chunks.nbytes
+    else:
+        size = sum(len(chunk['text']) + 200 for chunk in chunks)
+    for key in ('vector_index', 'keyword_index'):
+        index = entry.get(key)
+        if index is not None:
+            size += index.nbytes
+    return size
+
+
+class DocumentCache:
+    """
+    Content-addressed cache of chunked and indexed documents.
+
+    Entries live in an in-memory LRU bounded by total size and are written
+    through to a directory of memory-mappable index files (utils.index_store),
+    so a known document never has to go through PDFLoader.load_pdf again,
+    even after a restart or in another worker process.
+
+    Keys are content hashes; entries are stored under entry_key(key, settings),
+    so caches with different chunking settings can share a directory.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, cache_dir: Optional[str] = None,
+                 max_disk_bytes: int = 1024 * 1024 * 1024, settings: str = ''):
+        self.max_bytes = max_bytes
+        self.settings = settings
+        self.cache_dir = cache_dir or None
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._revisions_file_lock = threading.Lock()  # one revisions.json writer at a time
+        self._revisions: Dict[str, str] = {}  # document name -> hash of its latest revision
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            try:
+                with open(os.path.join(self.cache_dir, 'revisions.json'), encoding='utf-8') as f:
+                    self._revisions = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def __contains__(self, key: str) -> bool:
+        return entry_key(key, self.settings) in self._entries or (
+            self.cache_dir is not None and os.path.exists(self._path(key)))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{entry_key(key, self.settings)}.idx")
+
+    def get(self, key: str) -> Optional[Dict[str, any]]:
+        """Return a cached document, checking memory first and then disk"""
+        slot = entry_key(key, self.settings)
+        with self._lock:
+            if slot in self._entries:
+                self._entries.move_to_end(slot)
+                return self._entries[slot]
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, entry: Dict[str, any]):
+        """Cache a document in memory and on disk"""
+        self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def _remember(self, key: str, entry: Dict[str, any]):
+        size = entry_size(entry)
+        slot = entry_key(key, self.settings)
+        with self._lock:
+            if slot in self._entries:
+                self._total_bytes -= self._sizes.pop(slot)
+                del self._entries[slot]
+            self._entries[slot] = entry
+            self._sizes[slot] = size
+            self._total_bytes += size
+
+            # Evict least recently used documents, but always keep the newest
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, _ = self._entries.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(old_key)
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, any]]:
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            entry = index_store.load_document(path)
+            os.utime(path)  # mark as recently used for disk pruning
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading document cache {path}: {e}")
+            return None
+
+    def _write_disk(self, key: str, entry: Dict[str, any]):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            index_store.save_document(path, entry['chunks'], entry['vector_index'], entry['keyword_index'],
+                                      entry.get('page_hashes'))
+            self._prune_disk()
+        except Exception as e:
+            print(f"Error writing document cache {path}: {e}")
+
+    def _prune_disk(self):
+        """Delete the least recently used files once the directory is over its cap"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.idx'):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in files)
+        # The newest file is the one just written, never prune it
+        for _, size, name in sorted(files)[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    def latest_revision(self, name: str) -> Optional[str]:
+        """Hash of the last document cached under this name (e.g. an uploaded file name)"""
+        with self._lock:
+            return self._revisions.get(name)
+
+    def record_revision(self, name: str, key: str):
+        """Remember key as the latest revision of the document called name"""
+        with self._lock:
+            if self._revisions.get(name) == key:
+                return
+            self._revisions[name] = key
+        if not self.cache_dir:
+            return
+        path = os.path.join(self.cache_dir, 'revisions.json')
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._revisions_file_lock:
+            # Snapshot inside the file lock, so an older snapshot never overwrites a newer one
+            with self._lock:
+                revisions = dict(self._revisions)
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(revisions, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Error writing document revisions {path}: {e}")
+
+    def clear(self):
+        """Drop all in-memory entries (disk entries are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
@@ -0,0 +1,201 @@
+"""
+Local stand-in LLM provider for offline load and latency testing.
+
+FakeLLM answers the engine's prompts in-process with no network or keys: it
+sleeps for a latency drawn from a configurable distribution, fails at a
+configurable rate, enforces a token-bucket rate limit, and replies with a
+chunk number (chunk selection prompts) or an answer (everything else).
+
+It is the 'fake' entry of utils.providers.PROVIDERS and is enabled by
+setting RAG_FAKE_LLM to a spec of comma-separated options, or to 1 for the
+defaults:
+
+    RAG_FAKE_LLM="latency=lognormal:400:0.5,error_rate=0.05,rate_limit=5,burst=10"
+
+Options:
+    latency     const:MS | uniform:LO:HI | normal:MEAN:SD | lognormal:MEDIAN:SIGMA | exp:MEAN
+                (milliseconds; default const:0)
+    error_rate  fraction of calls that raise FakeProviderError (default 0)
+    rate_limit  requests per second before FakeRateLimitError (default unlimited)
+    burst       requests allowed at once under rate_limit (default rate_limit, at least 1)
+    chunk       keyword (best word overlap with the question), first, random or a number
+    answer      canned answer text; default quotes the start of the prompt's context
+    seed        random seed for latencies, errors and random chunks
+    token_latency  delay between streamed words, same distributions as latency
+                (the latency option is then the time to the first word)
+
+Several fakes (e.g. to load-test the fallback chain) can be registered in
+code with register_provider(fake_backend('fake_slow', latency='const:2000')).
+"""
+import math
+import random
+import re
+import threading
+import time
+from typing import Dict, Iterator, Optional, Union
+
+from utils.providers import ProviderBackend
+
+_QUESTION = re.compile(r'Given this question: "(.*?)"', re.DOTALL)
+_CHUNK = re.compile(r'^\s*Chunk (\d+) \([^)]*\): (.*)$', re.MULTILINE)
+_CONTEXT = re.compile(r'Context from security policy document:\s*(.*?)\s*Question:', re.DOTALL)
+_WORD = re.compile(r'[a-z0-9]{3,}')
+
+
+class FakeProviderError(Exception):
+    """Injected provider failure"""
+
+
+class FakeRateLimitError(FakeProviderError):
+    """Request rejected by the fake provider's rate limit (HTTP 429 stand-in)"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limit exceeded, retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+def parse_latency(spec: str):
+    """Sampler for a latency spec such as 'lognormal:400:0.5'; returns seconds"""
+    kind, *params = spec.split(':')
+    values = [float(param) / 1000 for param in params]
+    if kind == 'lognormal':
+        values[1:] = [float(param) for param in params[1:]]  # sigma is unitless
+    if kind == 'const':
+        return lambda rng: values[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda rng: values[0] * math.exp(rng.gauss(0.0, values[1]))
+    if kind == 'exp':
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_spec(spec: Optional[str]) -> Dict[str, str]:
+    """Options from a RAG_FAKE_LLM value ('1' or empty means the defaults)"""
+    options = {}
+    for item in (spec or '').split(','):
+        key, sep, value = item.partition('=')
+        if sep:
+            options[key.strip()] = value.strip()
+    return options
+
+
+class FakeLLM:
+    """In-process fake provider client (see module docstring for options)"""
+
+    def __init__(self, latency: str = 'const:0', error_rate: Union[str, float] = 0.0,
+                 rate_limit: Union[str, float, None] = None, burst: Union[str, float, None] = None,
+                 chunk: str = 'keyword', answer: Optional[str] = None, seed: Union[str, int, None] = None,
+                 token_latency: str = 'const:0'):
+        self.latency_spec = latency
+        self._sample_latency = parse_latency(latency)
+        self._sample_token_latency = parse_latency(token_latency)
+        self.error_rate = float(error_rate)
+        self.rate_limit = float(rate_limit) if rate_limit else None
+        self.burst = max(1.0, float(burst) if burst else (self.rate_limit or 1.0))
+        self.chunk = chunk
+        self.answer = answer
+        self._rng = random.Random(int(seed) if seed is not None else None)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self.calls = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    def _acquire(self):
+        """Take a token from the bucket or raise FakeRateLimitError"""
+        if self.rate_limit is None:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_limit)
+        self._refilled_at = now
+        if self._tokens < 1:
+            self.rate_limited += 1
+            raise FakeRateLimitError((1 - self._tokens) / self.rate_limit)
+        self._tokens -= 1
+
+    def generate(self, prompt: str, max_tokens: int = 200, timeout: Optional[float] = None) -> str:
+        """Reply to a prompt after a simulated delay, or fail as configured"""
+        delay, fail, pick = self._begin()
+        self._wait(delay, fail, timeout)
+        return self._reply(prompt, max_tokens, pick)
+
+    def stream_generate(self, prompt: str, max_tokens: int = 200, timeout: Optional[float] = None) -> Iterator[str]:
+        """Like generate, but yields the reply word by word, token_latency apart"""
+        delay, fail, pick = self._begin()
+        self._wait(delay, fail, timeout)
+        for i, word in enumerate(self._reply(prompt, max_tokens, pick).split(' ')):
+            if i:
+                with self._lock:
+                    gap = self._sample_token_latency(self._rng)
+                time.sleep(gap)
+            yield word if i == 0 else ' ' + word
+
+    def _begin(self):
+        """Count a call and draw its latency, failure and chunk pick"""
+        with self._lock:
+            self.calls += 1
+            self._acquire()
+            delay = self._sample_latency(self._rng)
+            fail = self._rng.random() < self.error_rate
+            pick = self._rng.random()
+        return delay, fail, pick
+
+    def _wait(self, delay: float, fail: bool, timeout: Optional[float]):
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"fake provider did not respond within {timeout}s")
+        time.sleep(delay)
+        if fail:
+            with self._lock:
+                self.errors += 1
+            raise FakeProviderError("injected provider error")
+
+    def _reply(self, prompt: str, max_tokens: int, pick: float) -> str:
+        chunks = _CHUNK.findall(prompt)
+        if chunks:
+            return str(self._choose_chunk(prompt, chunks, pick))
+        if self.answer:
+            return self.answer
+        context = _CONTEXT.search(prompt)
+        text = re.sub(r'\[[^\]]*\]\s*', '', context.group(1)) if context else prompt.strip()
+        return ' '.join(text.split()[:max_tokens]) or "The document doesn't contain enough information to answer this question."
+
+    def _choose_chunk(self, prompt: str, chunks, pick: float) -> int:
+        if self.chunk == 'first':
+            return 1
+        if self.chunk == 'random':
+            return 1 + int(pick * len(chunks))
+        if self.chunk.isdigit():
+            return int(self.chunk)
+        question = _QUESTION.search(prompt)
+        words = set(_WORD.findall(question.group(1).lower())) if question else set()
+        overlap = [(len(words & set(_WORD.findall(text.lower()))), -int(number)) for number, text in chunks]
+        return -max(overlap)[1]
+
+    def stats(self) -> Dict[str, any]:
+        with self._lock:
+            return {'calls': self.calls, 'errors': self.errors, 'rate_limited': self.rate_limited,
+                    'latency': self.latency_spec}
+
+
+def fake_backend(name: str = 'fake', api_key_env: Optional[str] = None, **options) -> ProviderBackend:
+    """
+    Provider backend serving FakeLLM clients. With api_key_env the client's
+    options are read from that variable's spec (plus any given here);
+    without it the backend is always enabled.
+    """
+    def create(api_key: str, model_id: str, timeout: float) -> FakeLLM:
+        return FakeLLM(**{**options, **parse_spec(api_key)})
+
+    def call(client: FakeLLM, model_id: str, prompt: str, max_tokens: int, timeout: float) -> str:
+        return client.generate(prompt, max_tokens, timeout)
+
+    def stream(client: FakeLLM, model_id: str, prompt: str, max_tokens: int, timeout: float) -> Iterator[str]:
+        return client.stream_generate(prompt, max_tokens, timeout)
+
+    return ProviderBackend(name, f"Fake LLM ({name})", f"{name}-local", api_key_env, create, call, stream)
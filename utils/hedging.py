@@ -0,0 +1,73 @@
+import time
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+from typing import Callable, List, Optional, Tuple
+
+
+def hedged_call(candidates: List[Tuple[str, Callable[[], any]]], executor: Executor,
+                hedge_delay: float, timeouts: dict, default_timeout: float = 30.0
+                ) -> Tuple[Optional[str], any, List[Tuple[str, Exception]]]:
+    """
+    Race candidate calls in priority order with hedging.
+
+    The first candidate starts immediately. If it has not produced a valid
+    result within hedge_delay seconds, the next one is started as well, and
+    so on; a failed or invalid result (None) starts the next candidate at
+    once. The first valid result wins and every other in-flight call is
+    cancelled (queued calls never start; running ones are abandoned and
+    their results ignored). Each call is given up on after its provider's
+    timeout.
+
+    Returns: (winner_name, value, errors); winner_name is None if every
+    candidate failed.
+    """
+    queue = list(candidates)
+    pending = {}
+    errors = []
+    next_hedge = 0.0
+
+    def launch():
+        nonlocal next_hedge
+        name, call = queue.pop(0)
+        now = time.monotonic()
+        pending[executor.submit(call)] = (name, now + timeouts.get(name, default_timeout))
+        next_hedge = now + hedge_delay
+
+    def cancel_all():
+        for future in pending:
+            future.cancel()
+        pending.clear()
+
+    launch()
+    while pending or queue:
+        if not pending:
+            launch()
+            continue
+
+        now = time.monotonic()
+        wake_at = min(deadline for _, deadline in pending.values())
+        if queue:
+            wake_at = min(wake_at, next_hedge)
+        done, _ = wait(list(pending), timeout=max(0.0, wake_at - now), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            name, _ = pending.pop(future)
+            try:
+                value = future.result()
+            except Exception as e:
+                errors.append((name, e))
+                continue
+            if value is not None:
+                cancel_all()
+                return name, value, errors
+
+        now = time.monotonic()
+        for future, (name, deadline) in list(pending.items()):
+            if now >= deadline:
+                del pending[future]
+                future.cancel()
+                errors.append((name, TimeoutError(f"{name} did not respond within its timeout")))
+
+        if queue and (not pending or now >= next_hedge):
+            launch()
+
+    return None, None, errors
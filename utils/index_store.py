@@ -0,0 +1,236 @@
+"""
+Persistent, memory-mappable format for a document's chunks and indexes.
+
+Layout of a .idx file:
+    8 bytes   magic b'CVYRIDX\\0'
+    4 bytes   format version (little-endian uint32)
+    4 bytes   JSON header length (little-endian uint32)
+    N bytes   JSON header: scalar settings plus dtype/shape/offset of each array
+    ...       raw little-endian arrays, each aligned to 64 bytes
+
+Arrays are opened with mmap, so loading costs a header parse and the page
+cache is shared between every process that opens the same file.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from utils.chunk_store import ChunkStore
+from utils.keyword_index import KeywordIndex
+from utils.vector_index import VectorIndex
+
+MAGIC = b'CVYRIDX\0'
+FORMAT_VERSION = 4  # 2: chunk end offsets clamped to the page text, 3: token-sized chunks, 4: sparse vector rows
+_ALIGN = 64
+_PREAMBLE = struct.Struct('<8sII')
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class MappedTexts:
+    """Read-only sequence of page texts decoded on access from one UTF-8 blob"""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return self._blob[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        return self._blob.nbytes + self._offsets.nbytes
+
+
+class MappedPostings:
+    """Read-only term -> (chunk ids, term frequencies) mapping over flat arrays"""
+
+    def __init__(self, terms: list, offsets: np.ndarray, ids: np.ndarray, freqs: np.ndarray):
+        self._slots = {term: i for i, term in enumerate(terms)}
+        self._offsets = offsets
+        self._ids = ids
+        self._freqs = freqs
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self._slots
+
+    def __getitem__(self, term: str):
+        slot = self._slots[term]
+        start, end = int(self._offsets[slot]), int(self._offsets[slot + 1])
+        return self._ids[start:end], self._freqs[start:end]
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def items(self):
+        for term in self._slots:
+            yield term, self[term]
+
+
+def _encode_texts(texts) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded], dtype=np.int64)
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def save_document(path: str, chunks: ChunkStore, vector_index: VectorIndex, keyword_index: KeywordIndex,
+                  page_hashes: List[bytes] = None):
+    """
+    Write a document's chunk store and indexes to path (atomically), with
+    the page fingerprints used for incremental re-ingest if given
+    """
+    page_blob, page_offsets = _encode_texts(chunks.page_texts)
+    vector_offsets, vector_rows, vector_values = vector_index.columns()
+
+    terms = list(keyword_index.postings)
+    postings = [keyword_index.postings[term] for term in terms]
+    postings_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    postings_offsets[1:] = np.cumsum([len(ids) for ids, _ in postings], dtype=np.int64)
+    term_blob, term_offsets = _encode_texts(terms)
+
+    arrays = {
+        'page_text_blob': page_blob,
+        'page_text_offsets': page_offsets,
+        'chunk_pages': np.asarray(chunks.pages, dtype=np.int32),
+        'chunk_page_slots': np.asarray(chunks.page_slots, dtype=np.int32),
+        'chunk_starts': np.asarray(chunks.starts, dtype=np.int32),
+        'chunk_ends': np.asarray(chunks.ends, dtype=np.int32),
+        'vector_offsets': np.asarray(vector_offsets, dtype=np.int64),
+        'vector_rows': np.asarray(vector_rows, dtype=np.int32),
+        'vector_values': np.asarray(vector_values, dtype=np.float32),
+        'vector_doc_freq': np.asarray(vector_index.doc_freq, dtype=np.int32),
+        'vector_row_norms': np.asarray(vector_index._norms() if len(vector_index) else [], dtype=np.float32),
+        'term_blob': term_blob,
+        'term_offsets': term_offsets,
+        'postings_offsets': postings_offsets,
+        'postings_ids': np.concatenate([ids for ids, _ in postings]).astype(np.int32) if postings else np.zeros(0, dtype=np.int32),
+        'postings_freqs': np.concatenate([freqs for _, freqs in postings]).astype(np.float32) if postings else np.zeros(0, dtype=np.float32),
+        'doc_lengths': np.asarray(keyword_index.doc_lengths, dtype=np.float32),
+        'security_counts': np.asarray(keyword_index.security_counts, dtype=np.float32),
+        'length_bonus': np.asarray(keyword_index.length_bonus, dtype=np.float32),
+        'page_hashes': np.frombuffer(b''.join(page_hashes or []), dtype=np.uint8).reshape(-1, 32),
+    }
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        arrays[name] = array = array.astype(array.dtype.newbyteorder('<'), copy=False)
+        offset = _align(offset)
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+
+    header = json.dumps({
+        'vector_dim': vector_index.dim,
+        'vector_count': len(vector_index),
+        'k1': keyword_index.k1,
+        'b': keyword_index.b,
+        'security_weight': keyword_index.security_weight,
+        'arrays': layout
+    }).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    # Unique per process and thread: sessions may cache the same document at once
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_document(path: str) -> Dict[str, any]:
+    """
+    Memory-map a saved document
+    Returns: {'chunks': ChunkStore, 'vector_index': VectorIndex, 'keyword_index': KeywordIndex,
+              'page_hashes': [bytes]} (page_hashes empty if the file has none)
+    Raises ValueError if the file is not in the current format
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, header_len = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a version {FORMAT_VERSION} index file")
+    header = json.loads(bytes(buffer[_PREAMBLE.size:_PREAMBLE.size + header_len]))
+    data_start = _align(_PREAMBLE.size + header_len)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        if count == 0:
+            arrays[name] = np.zeros(spec['shape'], dtype=dtype)
+            continue
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + spec['offset']
+        ).reshape(spec['shape'])
+
+    chunks = ChunkStore()
+    chunks.page_texts = MappedTexts(arrays['page_text_blob'], arrays['page_text_offsets'])
+    chunks.pages = arrays['chunk_pages']
+    chunks.page_slots = arrays['chunk_page_slots']
+    chunks.starts = arrays['chunk_starts']
+    chunks.ends = arrays['chunk_ends']
+
+    vector_index = VectorIndex(dim=header['vector_dim'])
+    vector_index.add_columns(arrays['vector_offsets'], arrays['vector_rows'], arrays['vector_values'], header['vector_count'])
+    vector_index.doc_freq = arrays['vector_doc_freq']
+    vector_index._row_norms = arrays['vector_row_norms'] if len(arrays['vector_row_norms']) else None
+
+    keyword_index = KeywordIndex(k1=header['k1'], b=header['b'], security_weight=header['security_weight'])
+    terms = list(MappedTexts(arrays['term_blob'], arrays['term_offsets']))
+    keyword_index.postings = MappedPostings(terms, arrays['postings_offsets'], arrays['postings_ids'], arrays['postings_freqs'])
+    keyword_index.doc_lengths = arrays['doc_lengths']
+    keyword_index.security_counts = arrays['security_counts']
+    keyword_index.length_bonus = arrays['length_bonus']
+
+    page_hashes = [row.tobytes() for row in arrays['page_hashes']] if 'page_hashes' in arrays else []
+    return {'chunks': chunks, 'vector_index': vector_index, 'keyword_index': keyword_index, 'page_hashes': page_hashes}
+
+
+if __name__ == "__main__":
+    # Pre-build the warm-start index for one or more PDFs:
+    #   python -m utils.index_store sample_security_policy.pdf [more.pdf ...]
+    from utils.document_cache import document_hash, entry_key
+    from utils.pdf_loader import PDFLoader, read_pdf_bytes
+
+    cache_dir = os.getenv('RAG_CACHE_DIR')
+    if not cache_dir:
+        sys.exit("Set RAG_CACHE_DIR to the cache directory the app uses")
+    os.makedirs(cache_dir, exist_ok=True)
+    loader = PDFLoader()
+    for pdf_path in sys.argv[1:]:
+        pdf_bytes = read_pdf_bytes(pdf_path)
+        chunks = loader.load_pdf(pdf_bytes)
+        index_path = os.path.join(cache_dir, f"{entry_key(document_hash(pdf_bytes), loader.chunking_settings)}.idx")
+        save_document(index_path, chunks, loader.vector_index, loader.keyword_index, loader.page_hashes)
+        print(f"{pdf_path}: {len(chunks)} chunks -> {index_path}")
@@ -0,0 +1,226 @@
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.vector_index import copy_entries, copy_targets
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+
+# Words ignored when extracting keywords from a question
+COMMON_WORDS = {'do', 'you', 'what', 'how', 'when', 'where', 'why', 'is', 'are', 'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'your', 'have', 'does', 'can', 'will', 'should', 'would', 'could', 'has', 'had', 'been', 'being', 'this', 'that', 'these', 'those', 'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'he', 'him', 'his', 'himself', 'she', 'her', 'hers', 'herself', 'it', 'its', 'itself', 'they', 'them', 'their', 'theirs', 'themselves'}
+
+# Security terminology that boosts a chunk's relevance
+SECURITY_KEYWORDS = ['encrypt', 'security', 'access', 'control', 'backup', 'disaster', 'recovery', 'incident', 'response', 'policy', 'procedure', 'compliance', 'audit', 'monitor', 'log', 'authentication', 'authorization', 'confidentiality', 'integrity', 'availability', 'data', 'protection', 'privacy', 'gdpr', 'hipaa', 'soc', 'iso', 'vulnerability', 'patch', 'update', 'firewall', 'network', 'system', 'user', 'password', 'mfa', '2fa', 'multi-factor']
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """
+    Light suffix stripping so "encryption", "encrypted" and "encrypt"
+    share one postings list
+    """
+    if word.endswith('ies') and len(word) > 4:
+        word = word[:-3] + 'y'
+    elif word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+        word = word[:-1]
+    for suffix in ('ing', 'ion', 'ed'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            word = word[:-len(suffix)]
+            break
+    if word.endswith('e') and len(word) > 4:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, split and stem a piece of text"""
+    return [stem(token) for token in _TOKEN_RE.findall(text.lower())]
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index over document chunks, built once at ingest time.
+
+    Postings map each stemmed term to the chunks containing it and the term
+    frequency in each. Per-chunk security terminology counts and lengths are
+    precomputed, so a query only touches the postings of its own terms.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, security_weight: float = 0.1):
+        self.k1 = k1
+        self.b = b
+        self.security_weight = security_weight
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.security_counts = np.zeros(0, dtype=np.float32)
+        self.length_bonus = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def nbytes(self) -> int:
+        postings = sum(ids.nbytes + freqs.nbytes + len(term) + 100 for term, (ids, freqs) in self.postings.items())
+        return postings + self.doc_lengths.nbytes + self.security_counts.nbytes + self.length_bonus.nbytes
+
+    def build(self, texts: List[str]) -> 'KeywordIndex':
+        """Index every chunk, replacing anything already indexed"""
+        self.postings = {}
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.security_counts = np.zeros(0, dtype=np.float32)
+        self.length_bonus = np.zeros(0, dtype=np.float32)
+        return self.add(texts)
+
+    def add(self, texts: List[str]) -> 'KeywordIndex':
+        """Tokenize more chunks and merge their postings and statistics into the index"""
+        if not texts:
+            return self
+
+        if not isinstance(self.postings, dict):
+            # Memory-mapped index: materialize the postings before modifying
+            self.postings = dict(self.postings.items())
+
+        first_id = len(self)
+        new_postings = defaultdict(lambda: ([], []))
+        doc_lengths = []
+        security_counts = []
+        length_bonus = []
+
+        for doc_id, text in enumerate(texts, first_id):
+            doc_length, security_count, bonus = self._analyze(text, doc_id, new_postings)
+            doc_lengths.append(doc_length)
+            security_counts.append(security_count)
+            length_bonus.append(bonus)
+
+        # Per-chunk statistics go in before postings that reference the new chunks,
+        # so a query running during a streaming ingest never sees a dangling id
+        self.security_counts = np.concatenate([self.security_counts, np.asarray(security_counts, dtype=np.float32)])
+        self.length_bonus = np.concatenate([self.length_bonus, np.asarray(length_bonus, dtype=np.float32)])
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.asarray(doc_lengths, dtype=np.float32)])
+
+        for term, (ids, freqs) in new_postings.items():
+            ids = np.asarray(ids, dtype=np.int32)
+            freqs = np.asarray(freqs, dtype=np.float32)
+            if term in self.postings:
+                old_ids, old_freqs = self.postings[term]
+                ids = np.concatenate([old_ids, ids])
+                freqs = np.concatenate([old_freqs, freqs])
+            self.postings[term] = (ids, freqs)
+        return self
+
+    @staticmethod
+    def _analyze(text: str, doc_id: int, postings) -> Tuple[int, int, float]:
+        """
+        Add one chunk's term frequencies to postings (term -> ([ids], [freqs]))
+        Returns: (length in terms, security keyword count, length bonus)
+        """
+        terms = tokenize(text)
+        for term, freq in Counter(terms).items():
+            ids, freqs = postings[term]
+            ids.append(doc_id)
+            freqs.append(freq)
+
+        text_lower = text.lower()
+        security_count = sum(1 for keyword in SECURITY_KEYWORDS if keyword in text_lower)
+        # Bonus for longer, more detailed chunks
+        return len(terms), security_count, min(0.5, len(text_lower) / 1000)
+
+    def assemble(self, previous: 'KeywordIndex', sources: List[Optional[int]], texts: Dict[int, str]) -> 'KeywordIndex':
+        """
+        Index the chunks of a revised document, remapping the postings and
+        statistics of unchanged chunks from previous and tokenizing only the new ones
+        sources[i] is chunk i's id in previous, or None for a new chunk with text texts[i]
+        """
+        count = len(sources)
+        self.doc_lengths = np.zeros(count, dtype=np.float32)
+        self.security_counts = np.zeros(count, dtype=np.float32)
+        self.length_bonus = np.zeros(count, dtype=np.float32)
+
+        # New ids of every old chunk: none if it is gone, several if its page repeats
+        counts, offsets, targets = copy_targets(sources, len(previous))
+        reused = [(new_id, old_id) for new_id, old_id in enumerate(sources) if old_id is not None]
+        if reused:
+            new_ids, old_ids = (np.asarray(ids, dtype=np.int64) for ids in zip(*reused))
+            self.doc_lengths[new_ids] = previous.doc_lengths[old_ids]
+            self.security_counts[new_ids] = previous.security_counts[old_ids]
+            self.length_bonus[new_ids] = previous.length_bonus[old_ids]
+
+        parts = defaultdict(lambda: ([], []))
+        for term, (ids, freqs) in previous.postings.items():
+            copies, mapped = copy_entries(np.asarray(ids, dtype=np.int64), counts, offsets, targets)
+            if len(copies):
+                parts[term][0].append(mapped.astype(np.int32))
+                parts[term][1].append(freqs[copies])
+
+        new_postings = defaultdict(lambda: ([], []))
+        for new_id, text in texts.items():
+            self.doc_lengths[new_id], self.security_counts[new_id], self.length_bonus[new_id] = \
+                self._analyze(text, new_id, new_postings)
+        for term, (ids, freqs) in new_postings.items():
+            parts[term][0].append(np.asarray(ids, dtype=np.int32))
+            parts[term][1].append(np.asarray(freqs, dtype=np.float32))
+
+        # Postings ids must stay sorted (moved pages can reorder reused chunks)
+        self.postings = {}
+        for term, (id_parts, freq_parts) in parts.items():
+            ids = np.concatenate(id_parts)
+            freqs = np.concatenate(freq_parts)
+            order = np.argsort(ids, kind='stable')
+            self.postings[term] = (ids[order], freqs[order])
+        return self
+
+    @staticmethod
+    def query_terms(question: str) -> List[str]:
+        """Extract meaningful, stemmed keywords from a question"""
+        question_lower = question.lower()
+        words = [word for word in _TOKEN_RE.findall(question_lower) if word not in COMMON_WORDS and len(word) > 2]
+
+        # Add security keywords that match the question
+        for keyword in SECURITY_KEYWORDS:
+            if keyword in question_lower and keyword not in words:
+                words.append(keyword)
+
+        if not words:
+            words = _TOKEN_RE.findall(question_lower)
+
+        return list(dict.fromkeys(stem(word) for word in words))
+
+    def scores(self, question: str) -> np.ndarray:
+        """BM25 score of every chunk plus the security and length bonuses"""
+        doc_lengths = self.doc_lengths
+        n_docs = len(doc_lengths)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        if not n_docs:
+            return scores
+
+        avg_length = max(float(doc_lengths.mean()), 1.0)
+        for term in self.query_terms(question):
+            if term not in self.postings:
+                continue
+            ids, freqs = self.postings[term]
+            if ids[-1] >= n_docs:
+                # Chunks added by a concurrent ingest after this query started
+                cut = int(np.searchsorted(ids, n_docs))
+                ids, freqs = ids[:cut], freqs[:cut]
+            idf = np.log(1 + (n_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[ids] / avg_length)
+            scores[ids] += idf * freqs * (self.k1 + 1) / (freqs + norm)
+
+        bonus = self.security_counts[:n_docs] * self.security_weight + self.length_bonus[:n_docs]
+        return scores + bonus
+
+    def search(self, question: str, top_k: int = None) -> List[Tuple[int, float]]:
+        """
+        Rank chunks for a question
+        Returns: List of (chunk_index, score), best first
+        """
+        scores = self.scores(question)
+        if top_k is None or top_k >= len(scores):
+            order = np.argsort(-scores, kind='stable')
+        else:
+            top = np.argpartition(-scores, top_k)[:top_k]
+            order = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(i), float(scores[i])) for i in order]
@@ -1,88 +1,391 @@
 import PyPDF2
+import hashlib
 import io
-from typing import List, Dict
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Iterator, Tuple
 import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from utils.vector_index import VectorIndex
+from utils.keyword_index import KeywordIndex
+from utils.chunk_store import ChunkStore
+from utils.tokenizer import Tokenizer, get_tokenizer
+from utils.profiling import profiled, profiling_enabled
+
+def read_pdf_bytes(pdf_file) -> bytes:
+    """Get raw bytes from an uploaded file, file object, path or bytes"""
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return bytes(pdf_file)
+    if isinstance(pdf_file, str):
+        with open(pdf_file, 'rb') as f:
+            return f.read()
+    if hasattr(pdf_file, 'getvalue'):
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+# Set in each process-pool worker by _init_extract_worker: (loader, open PDF)
+_worker_state = None
+
+def _init_extract_worker(pdf_bytes: bytes, chunk_size: int, overlap: int, tokenizer_name: str = None):
+    """
+    Process-pool initializer: receive the PDF once per worker and parse it once
+    """
+    global _worker_state
+    loader = PDFLoader(workers=1, tokenizer=get_tokenizer(tokenizer_name))
+    loader.chunk_size = chunk_size
+    loader.overlap = overlap
+    _worker_state = (loader, PyPDF2.PdfReader(io.BytesIO(pdf_bytes)))
+
+def _extract_page_range(start: int, end: int) -> ChunkStore:
+    """
+    Process-pool worker: extract and chunk pages [start, end) of the worker's PDF
+    """
+    loader, pdf_reader = _worker_state
+    return loader._extract_pages(pdf_reader, start, end)
+
+def _pool_context():
+    """
+    Start workers without forking this (threaded) process: forkserver where
+    available, spawn elsewhere
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+def _stream_bytes(obj) -> bytes:
+    """Raw (still encoded) bytes of a content stream or array of streams"""
+    obj = obj.get_object() if obj is not None else None
+    if obj is None:
+        return b''
+    if isinstance(obj, PyPDF2.generic.ArrayObject):
+        return b''.join(_stream_bytes(item) for item in obj)
+    return getattr(obj, '_data', b'') or b''
+
+def _resolve(obj) -> dict:
+    """Dereference an optional PDF dictionary"""
+    return obj.get_object() if obj is not None else {}
+
+def page_fingerprint(page, salt: str = '') -> bytes:
+    """
+    SHA-256 of what a page's text is extracted from: its content streams,
+    the streams of form XObjects it draws, and its font names and encodings.
+    Hashes the encoded bytes, so it costs a small fraction of extract_text.
+    """
+    digest = hashlib.sha256(salt.encode('utf-8'))
+    digest.update(_stream_bytes(page.get('/Contents')))
+    resources = _resolve(page.get('/Resources'))
+    for name, xobject in sorted(_resolve(resources.get('/XObject')).items()):
+        xobject = xobject.get_object()
+        if xobject.get('/Subtype') == '/Form':
+            digest.update(name.encode('utf-8') + _stream_bytes(xobject))
+    for name, font in sorted(_resolve(resources.get('/Font')).items()):
+        font = font.get_object()
+        digest.update(f"{name}:{font.get('/BaseFont')}:{font.get('/Encoding')}".encode('utf-8'))
+    return digest.digest()
 
 class PDFLoader:
-    def __init__(self):
+    def __init__(self, workers: int = None, min_parallel_pages: int = 64, tokenizer: Tokenizer = None):
         self.chunk_size = 500  # tokens
         self.overlap = 50      # tokens
+        self.tokenizer = tokenizer or get_tokenizer()  # counts the tokens above (RAG_TOKENIZER)
+        self.vector_index = None   # embeddings for the most recently loaded PDF
+        self.keyword_index = None  # BM25 index for the most recently loaded PDF
+        self.page_hashes = []      # page_fingerprint of each page of the most recently loaded PDF
+        self.changed_pages = []    # pages reload_pdf had to re-extract
+        
+        # Large PDFs are extracted on a process pool, one page range per task
+        self.workers = workers or int(os.getenv('PDF_EXTRACT_WORKERS', 0)) or os.cpu_count() or 1
+        self.min_parallel_pages = min_parallel_pages
     
-    def load_pdf(self, pdf_file) -> List[Dict[str, any]]:
+    @profiled('load_pdf')
+    def load_pdf(self, pdf_file) -> ChunkStore:
         """
         Load PDF and split into chunks
-        Returns: List of chunks with text, page number, and metadata
+        Returns: ChunkStore of chunks with text, page number, and metadata
         """
+        self.vector_index = None
+        self.keyword_index = None
+        self.page_hashes = []
         try:
             # Read PDF content
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            chunks = []
+            pdf_bytes = read_pdf_bytes(pdf_file)
+            pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+            num_pages = len(pdf_reader.pages)
             
-            for page_num, page in enumerate(pdf_reader.pages, 1):
-                # Extract text from page
-                text = page.extract_text()
-                if not text.strip():
-                    continue
-                
-                # Split text into chunks
-                page_chunks = self._split_text_into_chunks(text, page_num)
-                chunks.extend(page_chunks)
+            # Fingerprint every page so a later revision can reuse the unchanged ones
+            self.page_hashes = self._page_hashes(pdf_reader)
+            self.changed_pages = list(range(1, num_pages + 1))
+            
+            # Pool workers are invisible to the profilers, so extraction is serial while profiling
+            if self.workers > 1 and num_pages >= self.min_parallel_pages and not profiling_enabled():
+                chunks = self._extract_pages_parallel(pdf_bytes, num_pages)
+            else:
+                chunks = self._extract_pages(pdf_reader, 0, num_pages)
+            
+            # Embed and index every chunk once, at load time
+            self.vector_index = self.build_vector_index(chunks)
+            self.keyword_index = self.build_keyword_index(chunks)
             
             return chunks
             
         except Exception as e:
             print(f"Error loading PDF: {e}")
+            return ChunkStore()
+    
+    def reload_pdf(self, pdf_file, previous: Dict[str, any]) -> ChunkStore:
+        """
+        Load a revision of an already indexed PDF, extracting and indexing
+        only the pages whose content changed
+        previous: cache entry of the earlier revision (chunks, vector_index,
+        keyword_index and page_hashes)
+        Returns: ChunkStore like load_pdf; sets changed_pages to the pages re-extracted
+        """
+        self.vector_index = None
+        self.keyword_index = None
+        self.page_hashes = []
+        self.changed_pages = []
+        try:
+            pdf_bytes = read_pdf_bytes(pdf_file)
+            pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+            self.page_hashes = self._page_hashes(pdf_reader)
+            
+            # Old page number for each page fingerprint, and the old chunks of each page
+            old_pages = {page_hash: page_num for page_num, page_hash in enumerate(previous['page_hashes'], 1)}
+            if not any(page_hash in old_pages for page_hash in self.page_hashes):
+                # Nothing in common, e.g. a different document: regular (possibly parallel) load
+                return self.load_pdf(pdf_bytes)
+            old_chunks = previous['chunks']
+            old_chunk_ids = {}
+            for chunk_id, page_num in enumerate(old_chunks.pages):
+                old_chunk_ids.setdefault(int(page_num), []).append(chunk_id)
+            
+            chunks = ChunkStore()
+            sources = []    # old chunk id of each new chunk, None if it was re-extracted
+            new_texts = {}  # new chunk id -> text, for the re-extracted chunks
+            for page_num, page_hash in enumerate(self.page_hashes, 1):
+                old_page = old_pages.get(page_hash)
+                if old_page is not None:
+                    # Unchanged page (possibly moved): reuse its text and chunk offsets
+                    ids = old_chunk_ids.get(old_page, [])
+                    if ids:
+                        page_text = old_chunks.page_texts[old_chunks.page_slots[ids[0]]]
+                        chunks.add_page(page_num, page_text, [(int(old_chunks.starts[i]), int(old_chunks.ends[i])) for i in ids])
+                        sources.extend(ids)
+                    continue
+                
+                self.changed_pages.append(page_num)
+                text = pdf_reader.pages[page_num - 1].extract_text()
+                if not text.strip():
+                    continue
+                first_id = len(chunks)
+                chunks.add_page(page_num, *self._chunk_bounds(text))
+                for chunk_id in range(first_id, len(chunks)):
+                    sources.append(None)
+                    new_texts[chunk_id] = chunks.text(chunk_id)
+            
+            self.vector_index = VectorIndex().assemble(previous['vector_index'], sources, new_texts)
+            self.keyword_index = KeywordIndex().assemble(previous['keyword_index'], sources, new_texts)
+            return chunks
+        
+        except Exception as e:
+            print(f"Error reloading PDF, loading it in full: {e}")
+            return self.load_pdf(pdf_file)
+    
+    @property
+    def chunking_settings(self) -> str:
+        """Settings that decide how a PDF is chunked; cached chunks are only valid for the same ones"""
+        return f"{self.chunk_size}:{self.overlap}:{self.tokenizer.name}"
+    
+    def _page_hashes(self, pdf_reader) -> List[bytes]:
+        """Fingerprint of every page, salted with the chunking settings they were chunked with"""
+        try:
+            return [page_fingerprint(page, self.chunking_settings) for page in pdf_reader.pages]
+        except Exception as e:
+            # Only incremental re-ingest depends on these
+            print(f"Error fingerprinting PDF pages: {e}")
             return []
     
+    def _extract_pages(self, pdf_reader, start: int, end: int) -> ChunkStore:
+        """
+        Extract and chunk pages [start, end) of an open PDF, in page order
+        """
+        chunks = ChunkStore()
+        for page_num in range(start + 1, end + 1):
+            # Extract text from page
+            text = pdf_reader.pages[page_num - 1].extract_text()
+            if not text.strip():
+                continue
+            
+            # Split text into chunks
+            chunks.add_page(page_num, *self._chunk_bounds(text))
+        
+        return chunks
+    
+    def _extract_pages_parallel(self, pdf_bytes: bytes, num_pages: int) -> ChunkStore:
+        """
+        Split the page range across a process pool and merge the chunks in page order
+        """
+        # A few ranges per worker so one slow range doesn't stall the pool
+        num_ranges = min(num_pages, self.workers * 4)
+        bounds = [num_pages * i // num_ranges for i in range(num_ranges + 1)]
+        ranges = list(zip(bounds[:-1], bounds[1:]))
+        
+        try:
+            # The PDF is sent to each worker once, not with every range
+            with ProcessPoolExecutor(
+                max_workers=min(self.workers, num_ranges),
+                mp_context=_pool_context(),
+                initializer=_init_extract_worker,
+                initargs=(pdf_bytes, self.chunk_size, self.overlap, self.tokenizer.name)
+            ) as executor:
+                results = executor.map(
+                    _extract_page_range,
+                    [start for start, _ in ranges],
+                    [end for _, end in ranges]
+                )
+                chunks = ChunkStore()
+                for range_chunks in results:
+                    chunks.extend(range_chunks)
+                return chunks
+        except Exception as e:
+            print(f"Parallel PDF extraction failed, falling back to serial: {e}")
+            return self._extract_pages(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)), 0, num_pages)
+    
+    def iter_pages(self, pdf_file) -> Iterator[Tuple[int, str]]:
+        """
+        Yield (page_number, text) one page at a time
+        Accepts a path or file object so large PDFs are not copied into memory first
+        """
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        for page_num, page in enumerate(pdf_reader.pages, 1):
+            text = page.extract_text()
+            if text.strip():
+                yield page_num, text
+    
+    def iter_page_chunks(self, pdf_file) -> Iterator[ChunkStore]:
+        """
+        Yield a single-page ChunkStore per page without building the full chunk list
+        """
+        for page_num, text in self.iter_pages(pdf_file):
+            page_chunks = ChunkStore()
+            page_chunks.add_page(page_num, *self._chunk_bounds(text))
+            yield page_chunks
+    
+    def iter_chunks(self, pdf_file) -> Iterator[Dict[str, any]]:
+        """
+        Yield chunks page by page without building the full chunk list
+        """
+        for page_chunks in self.iter_page_chunks(pdf_file):
+            yield from page_chunks
+    
+    def stream_pdf(self, pdf_file, max_buffer_bytes: int = 4 * 1024 * 1024) -> Iterator[ChunkStore]:
+        """
+        Streaming ingest: extract, chunk and index a PDF page by page
+        
+        Chunks are buffered, each page embedded as it is read, until their
+        text plus their vector rows reach max_buffer_bytes (or the document
+        ends). The batch is then added to vector_index and keyword_index and
+        yielded, so earlier pages are searchable while later ones are still
+        being parsed. The vector index grows by one segment per batch, sized
+        to it, so indexing never copies the rows already indexed.
+        """
+        self.vector_index = VectorIndex()
+        self.keyword_index = KeywordIndex()
+        
+        batch = ChunkStore()
+        batch_rows = []  # embedded vector entries of each buffered page
+        batch_bytes = 0
+        for page_chunks in self.iter_page_chunks(pdf_file):
+            rows = self.vector_index.embed(page_chunks.texts(), first_row=len(batch))
+            batch_rows.append(rows)
+            batch.extend(page_chunks)
+            batch_bytes += sum(len(text) for text in page_chunks.page_texts) + sum(array.nbytes for array in rows)
+            if batch_bytes >= max_buffer_bytes:
+                self._index_batch(batch, batch_rows)
+                yield batch
+                batch = ChunkStore()
+                batch_rows = []
+                batch_bytes = 0
+        
+        if batch:
+            self._index_batch(batch, batch_rows)
+            yield batch
+    
+    def _index_batch(self, chunks: ChunkStore, rows: List[Tuple]):
+        """Append a batch of chunks, with their embedded vector entries per page, to the streaming indexes"""
+        self.vector_index.add_entries(rows, len(chunks))
+        self.keyword_index.add(chunks.texts())
+    
+    def build_vector_index(self, chunks: List[Dict[str, any]]) -> VectorIndex:
+        """
+        Compute offline embeddings for a list of chunks
+        """
+        return VectorIndex().build([chunk['text'] for chunk in chunks])
+    
+    def build_keyword_index(self, chunks: List[Dict[str, any]]) -> KeywordIndex:
+        """
+        Build the BM25 inverted index for a list of chunks
+        """
+        return KeywordIndex().build([chunk['text'] for chunk in chunks])
+    
     def _split_text_into_chunks(self, text: str, page_num: int) -> List[Dict[str, any]]:
         """
         Split text into overlapping chunks
         """
+        text, bounds = self._chunk_bounds(text)
+        chunks = []
+        for start, end in bounds:
+            chunk_text = text[start:end].strip()
+            chunks.append({
+                'text': chunk_text,
+                'page': page_num,
+                'start_char': start,
+                'end_char': end,
+                'tokens_estimate': self.tokenizer.count(chunk_text)
+            })
+        return chunks
+    
+    @profiled('chunk_bounds')
+    def _chunk_bounds(self, text: str) -> Tuple[str, List[Tuple[int, int]]]:
+        """
+        Normalize page text and find overlapping chunk boundaries of at most
+        chunk_size tokens, overlapping by about overlap tokens
+        Returns: (normalized_text, [(start_char, end_char), ...])
+        """
         # Clean text
         text = re.sub(r'\s+', ' ', text).strip()
         
-        # Simple token estimation (roughly 4 characters per token)
-        tokens = len(text) // 4
-        chunk_size_chars = self.chunk_size * 4
-        overlap_chars = self.overlap * 4
-        
-        chunks = []
-        start = 0
+        # Whole page encoded at once; chunks break between pieces, so never inside a word
+        spans = self.tokenizer.token_spans(text)
+        cumulative = list(accumulate(tokens for _, _, tokens in spans))  # tokens in spans[:i + 1]
         
-        while start < len(text):
-            end = start + chunk_size_chars
-            
-            # Don't break in the middle of a word
-            if end < len(text):
-                # Find the last space before the end
-                last_space = text.rfind(' ', start, end)
-                if last_space > start:
-                    end = last_space
-            
-            chunk_text = text[start:end].strip()
-            
-            if chunk_text:
-                chunks.append({
-                    'text': chunk_text,
-                    'page': page_num,
-                    'start_char': start,
-                    'end_char': end,
-                    'tokens_estimate': len(chunk_text) // 4
-                })
-            
-            # Move start position with overlap
-            start = max(start + 1, end - overlap_chars)
+        bounds = []
+        first = 0
+        while first < len(spans):
+            # Extend to the last piece that keeps the chunk within chunk_size (at least one piece)
+            before = cumulative[first - 1] if first else 0
+            last = max(first + 1, bisect_right(cumulative, before + self.chunk_size))
             
-            # Prevent infinite loop
-            if start >= len(text):
+            start, end = spans[first][0], spans[last - 1][1]
+            # Skip chunks that would be empty after stripping
+            if text[start:end].strip():
+                bounds.append((start, end))
+            if last >= len(spans):
                 break
+            
+            # Start the next chunk at most overlap tokens back, but always move forward
+            first = max(first + 1, bisect_left(cumulative, cumulative[last - 1] - self.overlap) + 1)
         
-        return chunks
+        return text, bounds
     
     def get_chunk_source(self, chunk: Dict[str, any]) -> str:
         """
-        Generate source citation for a chunk
+        Generate source citation for a chunk (with its document name for corpus chunks)
         """
+        if chunk.get('document'):
+            return f"{chunk['document']}, Page {chunk['page']}"
         return f"Page {chunk['page']}"
     
     def get_chunk_metadata(self, chunk: Dict[str, any]) -> Dict[str, any]:
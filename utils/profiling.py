@@ -0,0 +1,224 @@
+"""
+Opt-in CPU and allocation profiling for ingest and query hot paths.
+
+Functions decorated with @profiled('name') run normally until profiling
+is switched on, either with environment variables:
+
+    RAG_PROFILE=cprofile,sampling,tracemalloc   modes to use (any subset)
+    RAG_PROFILE_DIR=.rag_profiles               where dumps are written
+    RAG_PROFILE_MIN_MS=0                        skip dumps for faster calls
+    RAG_PROFILE_INTERVAL_MS=5                   sampling interval
+    RAG_PROFILE_TARGETS=load_pdf,chunk_bounds   only profile these names
+
+or from code / a CLI flag with configure(). Each outermost profiled call is
+one request and gets its own dumps (calls nested inside it are part of its
+profile):
+
+    cprofile     <name>.prof       deterministic; open with pstats or snakeviz
+    sampling     <name>.folded     stack samples with line numbers, in the
+                                   collapsed format flamegraph tools read
+    tracemalloc  <name>.tracemalloc snapshot (tracemalloc.Snapshot.load)
+                 <name>.alloc.txt  top allocation sites by line
+
+and a line in profiles.jsonl indexing the dumps.
+
+Profilers only see the calling process, so while profiling is on
+PDFLoader.load_pdf extracts pages serially instead of on its process pool.
+"""
+import cProfile
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+MODES = ('cprofile', 'sampling', 'tracemalloc')
+
+
+class ProfileConfig:
+    """Which profilers run, for which hooks, and where their dumps go"""
+
+    def __init__(self, modes: List[str], directory: str = '.rag_profiles', min_ms: float = 0.0,
+                 interval_ms: float = 5.0, targets: Optional[List[str]] = None, top_allocations: int = 25):
+        unknown = [mode for mode in modes if mode not in MODES]
+        if unknown:
+            raise ValueError(f"Unknown profiling mode(s) {unknown}, choose from: {', '.join(MODES)}")
+        self.modes = list(modes)
+        self.directory = directory
+        self.min_ms = min_ms
+        self.interval = interval_ms / 1000
+        self.targets = set(targets) if targets else None
+        self.top_allocations = top_allocations
+
+
+_config: Optional[ProfileConfig] = None
+_local = threading.local()  # .active: a profile is running on this thread
+_sequence = itertools.count(1)
+_index_lock = threading.Lock()
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False  # started here, so stopped here when the last user finishes
+
+
+def configure(modes=None, directory: str = None, min_ms: float = None, interval_ms: float = None,
+              targets: Optional[List[str]] = None) -> Optional[ProfileConfig]:
+    """
+    Switch profiling on (or off with no modes); unset arguments come from
+    the RAG_PROFILE* environment variables
+    """
+    global _config
+    if isinstance(modes, str):
+        modes = modes.split(',')
+    if modes is None:
+        modes = os.getenv('RAG_PROFILE', '').split(',')
+    modes = [mode.strip().lower() for mode in modes if mode and mode.strip()]
+    if not modes:
+        _config = None
+        return None
+    if targets is None and os.getenv('RAG_PROFILE_TARGETS'):
+        targets = [target.strip() for target in os.getenv('RAG_PROFILE_TARGETS').split(',')]
+    _config = ProfileConfig(
+        modes,
+        directory=directory or os.getenv('RAG_PROFILE_DIR', '.rag_profiles'),
+        min_ms=float(min_ms if min_ms is not None else os.getenv('RAG_PROFILE_MIN_MS', 0)),
+        interval_ms=float(interval_ms if interval_ms is not None else os.getenv('RAG_PROFILE_INTERVAL_MS', 5)),
+        targets=targets
+    )
+    return _config
+
+
+def profiling_enabled() -> bool:
+    """Whether any profiling mode is configured"""
+    return _config is not None
+
+
+class _Sampler(threading.Thread):
+    """Samples one thread's call stack at a fixed interval"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='rag-profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack and not self._stop_event.is_set():
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            _tracemalloc_owned = True
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc() -> tracemalloc.Snapshot:
+    global _tracemalloc_users, _tracemalloc_owned
+    snapshot = tracemalloc.take_snapshot()
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+    return snapshot
+
+
+def _run_profiled(config: ProfileConfig, name: str, func, args, kwargs):
+    profiler = cProfile.Profile() if 'cprofile' in config.modes else None
+    sampler = _Sampler(threading.get_ident(), config.interval) if 'sampling' in config.modes else None
+    if 'tracemalloc' in config.modes:
+        _start_tracemalloc()
+    if sampler:
+        sampler.start()
+    _local.active = True
+    start = time.perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profiler:
+                profiler.disable()
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _local.active = False
+        stacks = sampler.stop() if sampler else None
+        snapshot = _stop_tracemalloc() if 'tracemalloc' in config.modes else None
+        if duration_ms >= config.min_ms:
+            try:
+                _dump(config, name, duration_ms, profiler, stacks, snapshot)
+            except Exception as e:
+                print(f"Profile dump for {name} failed: {e}")
+
+
+def _dump(config: ProfileConfig, name: str, duration_ms: float, profiler, stacks: Optional[Counter],
+          snapshot: Optional[tracemalloc.Snapshot]):
+    os.makedirs(config.directory, exist_ok=True)
+    stem = os.path.join(config.directory, f"{datetime.now():%Y%m%d-%H%M%S}_{name}_{os.getpid()}_{next(_sequence)}")
+    files: Dict[str, str] = {}
+
+    if profiler is not None:
+        files['cprofile'] = stem + '.prof'
+        profiler.dump_stats(files['cprofile'])
+
+    if stacks is not None:
+        files['sampling'] = stem + '.folded'
+        with open(files['sampling'], 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    if snapshot is not None:
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        files['tracemalloc'] = stem + '.tracemalloc'
+        snapshot.dump(files['tracemalloc'])
+        files['allocations'] = stem + '.alloc.txt'
+        with open(files['allocations'], 'w', encoding='utf-8') as f:
+            for stat in snapshot.statistics('lineno')[:config.top_allocations]:
+                f.write(f"{stat}\n")
+
+    record = {'timestamp': datetime.now().isoformat(), 'name': name, 'duration_ms': round(duration_ms, 3),
+              'pid': os.getpid(), 'thread': threading.current_thread().name, 'files': files}
+    if stacks is not None:
+        record['samples'] = sum(stacks.values())
+    with _index_lock:
+        with open(os.path.join(config.directory, 'profiles.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+def profiled(name: str):
+    """Decorator profiling each outermost call of a function while profiling is configured"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            config = _config
+            if config is None or getattr(_local, 'active', False) or (config.targets and name not in config.targets):
+                return func(*args, **kwargs)
+            return _run_profiled(config, name, func, args, kwargs)
+        return wrapper
+    return decorate
+
+
+configure()
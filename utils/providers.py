@@ -0,0 +1,137 @@
+"""
+LLM provider backends.
+
+Each backend knows how to create its client and send a prompt, and imports
+its vendor SDK only when a client is created, so importing rag_engine or
+answering from keyword search alone never loads an SDK. RAGEngine tries the
+backends in PROVIDERS order; register new ones there. A backend's optional
+stream function yields the answer as text deltas for query_stream; without
+one the whole response arrives as a single delta. The 'fake' backend
+(utils/fake_provider.py) is a local stand-in for offline load testing.
+"""
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional
+
+from utils.lazy_import import LazyModule
+
+genai = LazyModule('google.generativeai')
+openai = LazyModule('openai')
+groq = LazyModule('groq')
+cohere = LazyModule('cohere')
+
+
+@dataclass(frozen=True)
+class ProviderBackend:
+    """How to build and call one provider"""
+    name: str
+    label: str        # shown in status messages
+    model_id: str     # also part of the response cache key
+    api_key_env: Optional[str]  # None: always enabled, no key needed
+    create: Callable[[str, str, float], any]           # (api_key, model_id, timeout) -> client
+    call: Callable[[any, str, str, int, float], str]   # (client, model_id, prompt, max_tokens, timeout) -> text
+    stream: Optional[Callable[[any, str, str, int, float], Iterator[str]]] = None  # same arguments -> text deltas
+
+
+def _create_gemini(api_key: str, model_id: str, timeout: float):
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_id)
+
+
+def _call_gemini(client, model_id: str, prompt: str, max_tokens: int, timeout: float) -> str:
+    response = client.generate_content(prompt, request_options={'timeout': timeout})
+    return response.text.strip()
+
+
+def _stream_gemini(client, model_id: str, prompt: str, max_tokens: int, timeout: float) -> Iterator[str]:
+    for chunk in client.generate_content(prompt, stream=True, request_options={'timeout': timeout}):
+        if chunk.text:
+            yield chunk.text
+
+
+def _call_chat_completion(client, model_id: str, prompt: str, max_tokens: int, timeout: float) -> str:
+    """Blocking call for OpenAI-compatible chat completion clients (OpenAI, Groq)"""
+    response = client.chat.completions.create(
+        model=model_id,
+        messages=[{"role": "user", "content": prompt}]
+    )
+    return response.choices[0].message.content.strip()
+
+
+def _stream_chat_completion(client, model_id: str, prompt: str, max_tokens: int, timeout: float) -> Iterator[str]:
+    """Streaming call for OpenAI-compatible chat completion clients (OpenAI, Groq)"""
+    for chunk in client.chat.completions.create(
+        model=model_id,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True
+    ):
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            yield delta
+
+
+def _create_openai(api_key: str, model_id: str, timeout: float):
+    return openai.OpenAI(api_key=api_key, timeout=timeout)
+
+
+def _create_groq(api_key: str, model_id: str, timeout: float):
+    return groq.Groq(api_key=api_key, timeout=timeout)
+
+
+def _create_cohere(api_key: str, model_id: str, timeout: float):
+    return cohere.Client(api_key, timeout=int(timeout))
+
+
+def _call_cohere(client, model_id: str, prompt: str, max_tokens: int, timeout: float) -> str:
+    response = client.generate(
+        model=model_id,
+        prompt=prompt,
+        max_tokens=max_tokens
+    )
+    return response.generations[0].text.strip()
+
+
+def _stream_cohere(client, model_id: str, prompt: str, max_tokens: int, timeout: float) -> Iterator[str]:
+    for event in client.generate(
+        model=model_id,
+        prompt=prompt,
+        max_tokens=max_tokens,
+        stream=True
+    ):
+        text = getattr(event, 'text', None)
+        if text and not getattr(event, 'is_finished', False):
+            yield text
+
+
+def _create_fake(api_key: str, model_id: str, timeout: float):
+    from utils.fake_provider import FakeLLM, parse_spec
+    return FakeLLM(**parse_spec(api_key))
+
+
+def _call_fake(client, model_id: str, prompt: str, max_tokens: int, timeout: float) -> str:
+    return client.generate(prompt, max_tokens, timeout)
+
+
+def _stream_fake(client, model_id: str, prompt: str, max_tokens: int, timeout: float) -> Iterator[str]:
+    return client.stream_generate(prompt, max_tokens, timeout)
+
+
+# Backends in fallback priority order
+PROVIDERS: Dict[str, ProviderBackend] = {
+    'fake': ProviderBackend('fake', 'Fake LLM', 'fake-local', 'RAG_FAKE_LLM', _create_fake, _call_fake, _stream_fake),
+    'gemini': ProviderBackend('gemini', 'Google Gemini', 'gemini-2.0-flash', 'GEMINI_API_KEY',
+                              _create_gemini, _call_gemini, _stream_gemini),
+    'openai': ProviderBackend('openai', 'OpenAI GPT-3.5', 'gpt-3.5-turbo', 'OPENAI_API_KEY',
+                              _create_openai, _call_chat_completion, _stream_chat_completion),
+    'groq': ProviderBackend('groq', 'Groq', 'llama3-8b-8192', 'GROQ_API_KEY',
+                            _create_groq, _call_chat_completion, _stream_chat_completion),
+    'cohere': ProviderBackend('cohere', 'Cohere', 'command', 'COHERE_API_KEY', _create_cohere, _call_cohere, _stream_cohere),
+}
+
+
+def register_provider(backend: ProviderBackend, before: Optional[str] = None):
+    """Add (or replace) a backend, at the end of the fallback order or before another one"""
+    items = [(name, existing) for name, existing in PROVIDERS.items() if name != backend.name]
+    position = next((i for i, (name, _) in enumerate(items) if name == before), len(items))
+    items.insert(position, (backend.name, backend))
+    PROVIDERS.clear()
+    PROVIDERS.update(items)
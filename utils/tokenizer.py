@@ -0,0 +1,165 @@
+"""
+Token counting for chunking and prompt budgets.
+
+GPT-style BPE tokenizers split text into pre-tokens before merging (a word
+with its leading space, a run of punctuation, up to three digits,
+whitespace), and a token never crosses a pre-token boundary. Every space
+starts a new pre-token, so text is cut at spaces into pieces (a word with
+its leading space) whose counts simply add up. Each distinct piece is
+counted once and memoized, and all unseen pieces of a page are encoded in a
+single batch.
+
+Backends (RAG_TOKENIZER, or get_tokenizer(name)):
+    tiktoken[:encoding]  exact counts for OpenAI BPE encodings (default,
+                         cl100k_base); downloads the encoding on first use,
+                         or reads it from TIKTOKEN_CACHE_DIR offline
+    heuristic            offline estimate with no dependencies, used when
+                         tiktoken or its encoding can't be loaded
+"""
+import os
+import re
+import threading
+from itertools import accumulate
+from typing import Callable, Dict, List, Tuple
+
+_PRETOKEN = re.compile(
+    r"'(?:[sdmt]|ll|ve|re)"           # contractions
+    r"|(?:[^\r\n\w]|_)?[^\W\d_]+"     # a word, with one leading space or symbol
+    r"|\d{1,3}"                       # digits, three at a time
+    r"| ?(?:[^\s\w]|_)+[\r\n]*"       # a run of punctuation
+    r"|\s*[\r\n]+|\s+(?!\S)|\s+",     # whitespace
+    re.IGNORECASE
+)
+
+
+class Tokenizer:
+    """
+    Base tokenizer: cuts text into space-delimited pieces and memoizes the
+    token count of each piece. Subclasses implement _encode_batch.
+    """
+
+    name = 'base'
+
+    def __init__(self, max_cached_pieces: int = 200000):
+        self.max_cached_pieces = max_cached_pieces
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _encode_batch(self, pretokens: List[str]) -> List[int]:
+        """Token count of each pre-token"""
+        raise NotImplementedError
+
+    def _count_pieces(self, pieces: List[str]) -> List[int]:
+        """Token count of each piece, encoding all their pre-tokens in one batch"""
+        split = [_PRETOKEN.findall(piece) for piece in pieces]
+        encoded = iter(self._encode_batch([pretoken for pretokens in split for pretoken in pretokens]))
+        return [sum(next(encoded) for _ in pretokens) for pretokens in split]
+
+    def token_spans(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        Pieces of text (a word with its leading space) with their token counts
+        Returns: [(start_char, end_char, tokens), ...] covering the text
+        """
+        words = text.split(' ')
+        pieces = words[:1] + [' ' + word for word in words[1:]]
+        counts = self._counts  # replaced, never cleared, when full, so lookups below stay valid
+        unseen = list({piece for piece in pieces if piece not in counts})
+        if unseen:
+            fresh = dict(zip(unseen, self._count_pieces(unseen)))
+            with self._lock:
+                if len(self._counts) + len(fresh) > self.max_cached_pieces:
+                    self._counts = {}
+                self._counts.update(fresh)
+            tokens = [fresh[piece] if piece in fresh else counts[piece] for piece in pieces]
+        else:
+            tokens = [counts[piece] for piece in pieces]
+
+        ends = list(accumulate(len(piece) for piece in pieces))
+        return [(end - len(piece), end, count) for piece, end, count in zip(pieces, ends, tokens)]
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text"""
+        return sum(tokens for _, _, tokens in self.token_spans(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of text that fits in max_tokens"""
+        total = 0
+        for start, end, tokens in self.token_spans(text):
+            if total + tokens > max_tokens:
+                return text[:start]
+            total += tokens
+        return text
+
+
+class HeuristicTokenizer(Tokenizer):
+    """
+    Offline estimate of GPT-style BPE counts: common words are one token,
+    long words and identifiers split every few characters, and each
+    punctuation symbol is usually its own token
+    """
+
+    name = 'heuristic'
+
+    def _encode_batch(self, pretokens: List[str]) -> List[int]:
+        return [self._estimate(pretoken) for pretoken in pretokens]
+
+    @staticmethod
+    def _estimate(pretoken: str) -> int:
+        body = pretoken.strip()
+        if not body:
+            return 1
+        if body.isdigit():
+            return 1
+        if body[0].isalpha() or (len(body) > 1 and body[1:].isalpha()):
+            # Lower-case words merge well; capitalised acronyms and IDs split more
+            letters = len(body)
+            per_token = 3 if body.isupper() and letters > 1 else 6
+            return max(1, -(-letters // per_token))
+        return max(1, len(body) // 2 + len(body) % 2)
+
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact counts from a tiktoken BPE encoding (optional dependency)"""
+
+    def __init__(self, encoding: str = 'cl100k_base', **kwargs):
+        super().__init__(**kwargs)
+        import tiktoken  # only needed when this backend is selected
+        self._encoding = tiktoken.get_encoding(encoding)
+        self.name = f"tiktoken:{encoding}"
+
+    def _encode_batch(self, pretokens: List[str]) -> List[int]:
+        return [len(tokens) for tokens in self._encoding.encode_ordinary_batch(pretokens)]
+
+
+DEFAULT_TOKENIZER = 'tiktoken:cl100k_base'
+
+# Tokenizer backends by name; register more here
+TOKENIZERS: Dict[str, Callable[..., Tokenizer]] = {
+    'heuristic': HeuristicTokenizer,
+    'tiktoken': TiktokenTokenizer
+}
+
+_instances: Dict[str, Tokenizer] = {}
+_instances_lock = threading.Lock()
+
+
+def get_tokenizer(name: str = None) -> Tokenizer:
+    """
+    Shared tokenizer instance for a backend spec such as 'heuristic' or
+    'tiktoken:cl100k_base' (defaults to RAG_TOKENIZER, then DEFAULT_TOKENIZER)
+    Falls back to the heuristic backend if the requested one can't load
+    """
+    name = name or os.getenv('RAG_TOKENIZER') or DEFAULT_TOKENIZER
+    with _instances_lock:
+        tokenizer = _instances.get(name)
+        if tokenizer is None:
+            backend, _, argument = name.partition(':')
+            try:
+                factory = TOKENIZERS[backend]
+                tokenizer = factory(argument) if argument else factory()
+            except Exception as e:
+                print(f"Tokenizer '{name}' unavailable, using heuristic estimates: {e}")
+                tokenizer = _instances.get('heuristic') or HeuristicTokenizer()
+                _instances['heuristic'] = tokenizer
+            _instances[name] = tokenizer
+        return tokenizer
@@ -0,0 +1,274 @@
+"""
+Per-stage latency tracing and metrics for the query path.
+
+Code marks stages with `with TRACER.span('llm_call', provider=...):` or the
+@traced('generate_answer') decorator. Spans nest
+(per thread/async context) into a trace whose root is the outermost span;
+each finished span also feeds a latency histogram, and counters track
+cache hits/misses, token counts and errors. Finished traces go to the
+configured exporters (RAG_METRICS_EXPORTER, comma-separated):
+
+    prometheus  metrics in Prometheus text format, served at
+                http://localhost:RAG_METRICS_PORT/metrics (default 9464);
+                unauthenticated, so it binds to RAG_METRICS_HOST (default
+                127.0.0.1, loopback only)
+    jsonl       one JSON line per trace appended to RAG_METRICS_JSONL
+                (default rag_traces.jsonl)
+
+Register more exporters in EXPORTERS.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Histogram buckets for stage latencies, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, any]) -> _Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items() if value is not None))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+    parts = [f'{label}="{value}"' for label, value in labels] + ([extra] if extra else [])
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Metrics:
+    """Thread-safe counters and latency histograms keyed by name and labels"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[_Key, float] = {}
+        self._histograms: Dict[_Key, List[float]] = {}  # bucket counts + [count, sum]
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def snapshot(self) -> Dict[str, any]:
+        """Counters, and count/sum/mean of each histogram, as plain dicts"""
+        with self._lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self._counters.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': h[-2], 'sum': round(h[-1], 6),
+                                'mean': round(h[-1] / h[-2], 6) if h[-2] else 0.0}
+                               for (name, labels), h in sorted(self._histograms.items())]
+            }
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {name} counter")
+                lines.extend(f"{name}{_format_labels(labels)} {value:g}"
+                             for (counter, labels), value in sorted(self._counters.items()) if counter == name)
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (histogram, labels), h in sorted(self._histograms.items()):
+                    if histogram != name:
+                        continue
+                    for bound, count in zip(self.buckets, h):
+                        le = 'le="%g"' % bound
+                        lines.append(f"{name}_bucket{_format_labels(labels, le)} {count}")
+                    le = 'le="+Inf"'
+                    lines.append(f"{name}_bucket{_format_labels(labels, le)} {h[-2]}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {h[-2]}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {h[-1]:.6f}")
+        return '\n'.join(lines) + '\n'
+
+
+class Span:
+    """One timed stage; labels become metric labels, attributes stay on the trace"""
+
+    __slots__ = ('name', 'labels', 'attributes', 'children', 'start', 'duration', 'error')
+
+    def __init__(self, name: str, labels: Dict[str, any]):
+        self.name = name
+        self.labels = labels
+        self.attributes: Dict[str, any] = {}
+        self.children: List['Span'] = []
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, any]:
+        return {
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            **({'labels': self.labels} if self.labels else {}),
+            **({'attributes': self.attributes} if self.attributes else {}),
+            **({'error': self.error} if self.error else {}),
+            'children': [child.to_dict() for child in list(self.children)]
+        }
+
+
+def flatten(trace: Dict[str, any], depth: int = 0) -> Iterator[Dict[str, any]]:
+    """Spans of a trace dict in start order, with their nesting depth"""
+    yield {'depth': depth, **{key: value for key, value in trace.items() if key != 'children'}}
+    for child in trace['children']:
+        yield from flatten(child, depth + 1)
+
+
+class JsonlExporter:
+    """Appends every finished trace to a JSON lines file"""
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('RAG_METRICS_JSONL', 'rag_traces.jsonl')
+        self._lock = threading.Lock()
+
+    def export(self, trace: Dict[str, any], metrics: Metrics):
+        line = json.dumps(trace, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+class PrometheusExporter:
+    """Serves the metrics registry at /metrics for a Prometheus scraper"""
+
+    def __init__(self, port: int = None, host: str = None):
+        self.port = int(port or os.getenv('RAG_METRICS_PORT', 9464))
+        self.host = host or os.getenv('RAG_METRICS_HOST', '127.0.0.1')
+        self.server = None
+
+    def start(self, metrics: Metrics):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            print(f"Metrics endpoint unavailable on {self.host}:{self.port}: {e}")
+            return
+        threading.Thread(target=self.server.serve_forever, name='rag-metrics', daemon=True).start()
+
+    def export(self, trace: Dict[str, any], metrics: Metrics):
+        pass  # scraped, not pushed
+
+
+# Exporter backends by name; register more here
+EXPORTERS: Dict[str, Callable[[], any]] = {
+    'jsonl': JsonlExporter,
+    'prometheus': PrometheusExporter
+}
+
+
+class Tracer:
+    """Creates spans, records their latencies and hands finished traces to exporters"""
+
+    def __init__(self, metrics: Metrics, exporters: List = None, keep_traces: int = 50):
+        self.metrics = metrics
+        self.exporters = list(exporters or [])
+        self.recent = deque(maxlen=keep_traces)  # finished traces, newest last
+        self._current: contextvars.ContextVar = contextvars.ContextVar('rag_span', default=None)
+        for exporter in self.exporters:
+            if hasattr(exporter, 'start'):
+                exporter.start(metrics)
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[Span]:
+        """Time a stage; labels (low-cardinality, e.g. provider) are added to its latency metric"""
+        parent = self._current.get()
+        span = Span(name, labels)
+        if parent is not None:
+            parent.children.append(span)
+        token = self._current.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            try:
+                self._current.reset(token)
+            except ValueError:
+                pass  # a generator's span closed from another context (e.g. an abandoned stream)
+            self.metrics.observe('rag_stage_duration_seconds', span.duration, stage=name, **labels)
+            if parent is None:
+                self._finish(span)
+
+    def _finish(self, root: Span):
+        trace = root.to_dict()
+        self.recent.append(trace)
+        for exporter in self.exporters:
+            try:
+                exporter.export(trace, self.metrics)
+            except Exception as e:
+                print(f"Trace export failed: {e}")
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Increment a counter, e.g. count('rag_cache_requests_total', cache='response', result='hit')"""
+        self.metrics.inc(name, value, **labels)
+
+    def current(self) -> Optional[Span]:
+        return self._current.get()
+
+
+def traced(name: str):
+    """Decorator running each call of a function in a span (TRACER.current() inside it)"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _configured_exporters() -> List:
+    exporters = []
+    for name in filter(None, (part.strip() for part in os.getenv('RAG_METRICS_EXPORTER', '').split(','))):
+        if name in EXPORTERS:
+            exporters.append(EXPORTERS[name]())
+        else:
+            print(f"Unknown metrics exporter '{name}', choose from: {', '.join(EXPORTERS)}")
+    return exporters
+
+
+METRICS = Metrics()
+TRACER = Tracer(METRICS, _configured_exporters())
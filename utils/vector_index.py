@@ -0,0 +1,244 @@
+import re
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+@lru_cache(maxsize=65536)
+def _token_features(token: str, dim: int) -> Tuple[int, ...]:
+    """
+    Hash a token into feature buckets: the whole word plus its character
+    trigrams, so "encrypt" and "encryption" share most of their features
+    """
+    padded = f" {token} "
+    features = [zlib.crc32(b'w:' + token.encode()) % dim]
+    features.extend(
+        zlib.crc32(padded[i:i + 3].encode()) % dim
+        for i in range(len(padded) - 2)
+    )
+    return tuple(features)
+
+
+def copy_targets(sources: List[Optional[int]], num_old: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Where each old chunk is copied to in a revision, one old chunk possibly
+    to several new ones (a page repeated in the new revision)
+    Returns: (copies per old id, offset of each old id's targets, new ids grouped by old id)
+    """
+    pairs = sorted((old_id, new_id) for new_id, old_id in enumerate(sources) if old_id is not None)
+    old_ids = np.asarray([old_id for old_id, _ in pairs], dtype=np.int64)
+    targets = np.asarray([new_id for _, new_id in pairs], dtype=np.int64)
+    counts = np.bincount(old_ids, minlength=num_old)
+    offsets = np.cumsum(counts) - counts
+    return counts, offsets, targets
+
+
+def copy_entries(ids: np.ndarray, counts: np.ndarray, offsets: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Expand entries that belong to old ids into one entry per new copy
+    Returns: (index into ids of each copy, its new id)
+    """
+    repeats = counts[ids]
+    source = np.repeat(np.arange(len(ids)), repeats)
+    position = np.arange(len(source)) - np.repeat(np.cumsum(repeats) - repeats, repeats) + np.repeat(offsets[ids], repeats)
+    return source, targets[position]
+
+
+class VectorIndex:
+    """
+    Offline embedding index over document chunks.
+
+    Each chunk is turned into a hashed word + character n-gram TF vector.
+    Only non-zero features are stored, column-wise (CSC): for every feature,
+    the chunks it occurs in and its TF there. Rows live in segments; every
+    add() appends one segment sized to its batch, so indexing more chunks
+    never reallocates or copies the rows already indexed. IDF weights are
+    kept as document frequencies, so chunks can be added incrementally while
+    the document is still being parsed. A query only reads the columns of
+    its own features to rank every chunk (TF-IDF cosine similarity).
+    """
+
+    def __init__(self, dim: int = 4096):
+        self.dim = dim
+        # (first row, row count, feature offsets [dim + 1], segment-local row ids, values) per segment
+        self._segments: List[Tuple[int, int, np.ndarray, np.ndarray, np.ndarray]] = []
+        self._count = 0
+        self.doc_freq = np.zeros(dim, dtype=np.int32)
+        self._idf = None
+        self._row_norms = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getstate__(self):
+        # Don't pickle the derived caches
+        state = self.__dict__.copy()
+        state['_idf'] = None
+        state['_row_norms'] = None
+        return state
+
+    @property
+    def idf(self) -> np.ndarray:
+        if self._idf is None:
+            self._idf = (np.log((1 + self._count) / (1 + self.doc_freq)) + 1.0).astype(np.float32)
+        return self._idf
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for segment in self._segments for array in segment[2:]) + self.doc_freq.nbytes
+
+    def _term_frequencies(self, text: str) -> np.ndarray:
+        """Sublinear term-frequency vector of hashed features for one text"""
+        buckets = []
+        for token in _TOKEN_RE.findall(text.lower()):
+            buckets.extend(_token_features(token, self.dim))
+        counts = np.bincount(np.asarray(buckets, dtype=np.int64), minlength=self.dim).astype(np.float32)
+        nonzero = counts > 0
+        counts[nonzero] = 1.0 + np.log(counts[nonzero])
+        return counts
+
+    def _columns(self, features: np.ndarray, rows: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """CSC arrays (feature offsets, row ids, values) from (feature, row, value) entries"""
+        order = np.lexsort((rows, features))
+        offsets = np.zeros(self.dim + 1, dtype=np.int64)
+        np.cumsum(np.bincount(features, minlength=self.dim), out=offsets[1:])
+        return offsets, rows[order].astype(np.int32), values[order].astype(np.float32)
+
+    def embed(self, texts: List[str], first_row: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        TF vectors of texts as sparse entries, without adding them to the index
+        Returns: (features, rows, values), rows numbered from first_row
+        """
+        features, rows, values = [], [], []
+        for row_id, text in enumerate(texts, first_row):
+            row = self._term_frequencies(text)
+            row_features = np.flatnonzero(row)
+            features.append(row_features)
+            rows.append(np.full(len(row_features), row_id, dtype=np.int32))
+            values.append(row[row_features])
+        if not texts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        return np.concatenate(features), np.concatenate(rows), np.concatenate(values)
+
+    def build(self, texts: List[str]) -> 'VectorIndex':
+        """Embed all chunk texts, replacing anything already indexed"""
+        self._segments = []
+        self._count = 0
+        self.doc_freq = np.zeros(self.dim, dtype=np.int32)
+        return self.add(texts)
+
+    def add(self, texts: List[str]) -> 'VectorIndex':
+        """Embed more chunk texts and append them to the index"""
+        if not texts:
+            return self
+        return self.add_entries([self.embed(texts)], len(texts))
+
+    def add_entries(self, parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray]], num_rows: int) -> 'VectorIndex':
+        """Append num_rows rows, given as embed() entries (rows numbered from 0), as one new segment"""
+        if not num_rows:
+            return self
+        return self.add_columns(*self._columns(*(np.concatenate(arrays) for arrays in zip(*parts))), num_rows)
+
+    def add_columns(self, offsets: np.ndarray, rows: np.ndarray, values: np.ndarray, num_rows: int) -> 'VectorIndex':
+        """Append num_rows rows given as CSC arrays (e.g. memory-mapped) as a new segment"""
+        if not num_rows:
+            return self
+        # doc_freq may be memory-mapped (read-only), so always build a new array
+        self.doc_freq = self.doc_freq + np.diff(offsets).astype(np.int32)
+        self._segments.append((self._count, num_rows, offsets, rows, values))
+        self._count += num_rows
+        self._idf = None
+        self._row_norms = None
+        return self
+
+    def entries(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Every stored (feature, row, value) entry, with rows numbered across segments"""
+        parts = [
+            (np.repeat(np.arange(self.dim), np.diff(offsets)), rows.astype(np.int64) + first_row, values)
+            for first_row, _, offsets, rows, values in self._segments
+        ]
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """All segments merged into one set of CSC arrays (offsets, row ids, values)"""
+        if len(self._segments) == 1:
+            return self._segments[0][2:]
+        return self._columns(*self.entries())
+
+    def assemble(self, previous: 'VectorIndex', sources: List[Optional[int]], texts: Dict[int, str]) -> 'VectorIndex':
+        """
+        Index the chunks of a revised document, copying the rows of unchanged
+        chunks from previous and embedding only the new ones
+        sources[i] is chunk i's id in previous, or None for a new chunk with text texts[i]
+        """
+        counts, offsets, targets = copy_targets(sources, len(previous))
+        features, rows, values = previous.entries()
+        kept, rows = copy_entries(rows, counts, offsets, targets)
+
+        new_ids = sorted(texts)
+        new_features, new_rows, new_values = self.embed([texts[new_id] for new_id in new_ids])
+        new_rows = np.asarray(new_ids, dtype=np.int64)[new_rows]
+
+        self._segments = []
+        self._count = 0
+        self.doc_freq = np.zeros(self.dim, dtype=np.int32)
+        return self.add_entries([(features[kept], rows, values[kept]),
+                                 (new_features, new_rows, new_values)], len(sources))
+
+    def _norms(self) -> np.ndarray:
+        """TF-IDF row norms"""
+        if self._row_norms is None:
+            squared = np.zeros(self._count, dtype=np.float64)
+            idf_squared = self.idf.astype(np.float64) ** 2
+            for first_row, num_rows, offsets, rows, values in self._segments:
+                weights = np.repeat(idf_squared, np.diff(offsets)) * values * values
+                squared[first_row:first_row + num_rows] = np.bincount(rows, weights=weights, minlength=num_rows)
+            norms = np.sqrt(squared).astype(np.float32)
+            norms[norms == 0] = 1.0
+            self._row_norms = norms
+        return self._row_norms
+
+    def scores(self, query: str) -> np.ndarray:
+        """Cosine similarity between the query and every indexed chunk"""
+        if not self._count:
+            return np.zeros(0, dtype=np.float32)
+
+        weighted_query = self._term_frequencies(query) * self.idf
+        query_norm = np.linalg.norm(weighted_query)
+        if query_norm == 0:
+            return np.zeros(self._count, dtype=np.float32)
+
+        weights = weighted_query * self.idf
+        features = np.flatnonzero(weights)
+        dots = np.zeros(self._count, dtype=np.float64)
+        for first_row, num_rows, offsets, rows, values in self._segments:
+            # Positions of the query features' entries in this segment
+            starts = offsets[features]
+            lengths = offsets[features + 1] - starts
+            total = int(lengths.sum())
+            if not total:
+                continue
+            postings = np.arange(total) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            dots[first_row:first_row + num_rows] = np.bincount(
+                rows[postings], weights=values[postings] * np.repeat(weights[features], lengths), minlength=num_rows
+            )
+        return (dots.astype(np.float32)) / (self._norms() * query_norm)
+
+    def search(self, query: str, top_k: int = None) -> List[Tuple[int, float]]:
+        """
+        Rank all chunks by cosine similarity
+        Returns: List of (chunk_index, score), best first
+        """
+        scores = self.scores(query)
+        if top_k is None or top_k >= len(scores):
+            order = np.argsort(-scores, kind='stable')
+        else:
+            top = np.argpartition(-scores, top_k)[:top_k]
+            order = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(i), float(scores[i])) for i in order]